@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Decode many SAME headers at once.
+
+decode_batch() takes headers, demodulator lines or alert_log.txt lines and returns a DecodeResult for each, in order,
+without printing anything or touching the decoder's recording state. Headers are framed and cleaned first and each
+distinct header is decoded once, and big batches are split across a process pool.
+
+    batch.py alert_log.txt              Print the readable text of every logged header
+    batch.py --json archive.txt         Print one JSON object per header
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import logging
+import sys
+
+import dsame
+import fips
+from framer import HEADER, SameFramer
+from header import HeaderError, parse_header
+
+CHUNK_SIZE = 2000
+PARALLEL_MIN = 20000  # Distinct headers below which a pool costs more than it saves
+
+DecodeResult = collections.namedtuple('DecodeResult', 'line header COUNTRY PSSCCC_list event MESSAGE error')
+
+
+def find_header(line):
+    """Return the first SAME header in a line, cleaned, or None"""
+    framer = SameFramer()
+    found = [same for kind, same in framer.feed(line) + framer.close() if kind == HEADER]
+    return dsame.clean_msg(found[0]) if found else None
+
+
+def decode_header(line, lang='EN', text=True, same=None):
+    """Decode the first SAME header in a line, or the header same already found in it, and return a DecodeResult"""
+    if same is None:
+        same = find_header(line)
+    if same is None:
+        return DecodeResult(line, None, None, (), None, None, 'SAME header not found')
+    try:
+        header = parse_header(same)[0]
+    except HeaderError as detail:
+        return DecodeResult(line, None, None, (), None, None, str(detail))
+    COUNTRY, bad_list = fips.detect_country(header.PSSCCC)
+    PSSCCC_list = tuple(sorted(code for code in header.PSSCCC if code not in bad_list))
+    try:
+        MESSAGE = dsame.render_message(header.ORG, header.EEE, list(PSSCCC_list), header.TTTT, header.JJJHHMM,
+                                       header.STATION, header.TYPE, header.LLLLLLLL, COUNTRY, lang) if text else None
+    except (KeyError, ValueError) as detail:
+        return DecodeResult(line, header, COUNTRY, PSSCCC_list, None, None, 'cannot decode: ' + str(detail))
+    return DecodeResult(line, header, COUNTRY, PSSCCC_list, dsame.get_event(header.EEE, lang), MESSAGE, None)
+
+
+def decode_chunk(headers, lang='EN', text=True):
+    """Decode cleaned headers, each standing for the lines it was found in"""
+    return [decode_header(same, lang, text, same) for same in headers]
+
+
+def decode_batch(headers, lang='EN', text=True, workers=None, chunk_size=CHUNK_SIZE):
+    """Decode an iterable of headers or lines and return a list of DecodeResult in the same order.
+
+    workers=1 decodes in this process, otherwise batches of PARALLEL_MIN or more distinct headers use a process pool
+    of that many workers (default: one per CPU).
+    """
+    lang = lang.upper()
+    lines = [line.strip() for line in headers]
+    found = [find_header(line) for line in lines]
+    # Copies of one header logged with different prefixes, noise or spacing are decoded once
+    unique = list(dict.fromkeys(same for same in found if same is not None))
+    if workers != 1 and len(unique) >= PARALLEL_MIN:
+        chunks = [unique[i:i + chunk_size] for i in range(0, len(unique), chunk_size)]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            decoded = [result for results in pool.map(decode_chunk, chunks, [lang] * len(chunks),
+                                                       [text] * len(chunks))
+                       for result in results]
+    else:
+        decoded = decode_chunk(unique, lang, text)
+    by_header = dict(zip(unique, decoded))
+    return [by_header[same]._replace(line=line) if same is not None else
+            DecodeResult(line, None, None, (), None, None, 'SAME header not found')
+            for line, same in zip(lines, found)]
+
+
+def as_json(result):
+    data = {'line': result.line, 'error': result.error}
+    if result.header is not None:
+        data.update(result.header._asdict(), PSSCCC=list(result.header.PSSCCC), COUNTRY=result.COUNTRY,
+                    PSSCCC_list=list(result.PSSCCC_list), event=result.event, MESSAGE=result.MESSAGE)
+    return json.dumps(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], prog='batch',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    parser.add_argument('files', nargs='*', help='files of headers or log lines (default: standard input)')
+    parser.add_argument('--lang', default='EN', help='set language')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per header')
+    parser.add_argument('--workers', type=int, help='worker processes for large inputs (1 disables the pool)')
+    parser.add_argument('--loglevel', default=40, type=int, choices=[10, 20, 30, 40, 50], help='set log level')
+    args = parser.parse_args()
+    logging.basicConfig(level=args.loglevel, format='%(levelname)s: %(message)s')
+    lines = []
+    for name in args.files or ['-']:
+        with (open(name, errors='replace') if name != '-' else sys.stdin) as f:
+            lines.extend(line for line in f if line.strip())
+    for result in decode_batch(lines, args.lang, workers=args.workers):
+        if args.json:
+            sys.stdout.write(as_json(result) + '\n')
+        elif result.error:
+            logging.warning(' '.join([result.error, '>', result.line]))
+        else:
+            sys.stdout.write(str(result.header) + ': ' + result.MESSAGE + '\n')
+
+
+if __name__ == "__main__":
+    main()
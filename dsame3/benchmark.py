@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""Timing checks for dsame3.
+
+    benchmark.py startup    Time a cold `dsame.py --msg` run and fail if it is over budget or loads audio modules
+    benchmark.py clean      Time clean_msg on clean, noisy and garbage demodulator lines
+    benchmark.py render     Time readable_message over a corpus of headers and check it against the 0.3.2.0 output
+    benchmark.py batch      Time decode_batch against one same_decode call per line on a simulated alert log
+    benchmark.py times      Time the alert start and end calculation against the 0.3.2.0 strptime version
+    benchmark.py gate       CPU per channel-hour of the built-in demodulator with and without the activity gate
+"""
+import argparse
+import os
+import statistics
+import string
+import subprocess
+import sys
+import time
+import timeit
+
+import defs
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DSAME = os.path.join(HERE, 'dsame.py')
+HEADER = defs.TEST_STRING.split(' ', 1)[1]
+
+# Headers as received from NWR and EAS participants
+CORPUS = [
+    'ZCZC-WXR-RWT-020103-020209-020091-020121-029047-029165-029095-029037+0030-1051700-KEAX/NWS-',
+    'ZCZC-WXR-TOR-029037-029095-029107+0045-1232150-KEAX/NWS-',
+    'ZCZC-WXR-SVR-055027-055039-055047-055117-055131-055137-055139-055015-055071+0100-0771800-KMKX/NWS-',
+    'ZCZC-WXR-FFW-022071-022051-022087-022075+0315-3650905-KLIX/NWS-',
+    'ZCZC-WXR-SVS-002020+0030-1231200-PAFC/NWS-',
+    'ZCZC-WXR-TOA-005001-005003-005005-005007-005009-005011-005013-005015-005017-005019-005021-005023-005025-005027-'
+    '005029-005031-005033-005035-005037-005039-005041-005043-005045-005047-005049-005051-005053-005055-005057-005059-'
+    '005061+0600-1351900-KLZK/NWS-',
+    'ZCZC-CIV-CAE-048000+0200-2101530-WABC/TV-',
+    'ZCZC-EAS-RMT-012000-012001-112003+0100-0011200-WXYZ/FM-',
+    'ZCZC-PEP-EAN-000000+0600-0500000-WHITEHOU-',
+    'ZCZC-WXR-TOA-011100-011200+0600-1051700-CWUL/EC-',
+    'ZCZC-WXR-RWT-029005+0030-832300-XDIF/005-',
+]
+
+REPEAT_EVERY = 10  # Share of batch benchmark alerts logged twice
+
+# Modules the --msg path must never import
+HEAVY_MODULES = ['faster_whisper', 'sounddevice', 'soundfile', 'numpy', 'tqdm', 'urllib.request']
+
+STARTUP_PROBE = """
+import runpy, sys
+sys.argv = [{dsame!r}, '--skip_dependency', '--no-text', '--msg', {msg!r}]
+try:
+    runpy.run_path({dsame!r}, run_name='__main__')
+finally:
+    sys.stderr.write('\\nloaded: ' + ' '.join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def startup(args):
+    probe = STARTUP_PROBE.format(dsame=DSAME, msg=HEADER, heavy=HEAVY_MODULES)
+    timings = []
+    loaded = ''
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', probe], cwd=HERE, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        timings.append(time.perf_counter() - start)
+        loaded = result.stderr.rpartition('loaded: ')[2].strip()
+    median = statistics.median(timings)
+    sys.stdout.write('--msg cold start: median %.1f ms, best %.1f ms over %d runs (budget %.1f ms)\n'
+                     % (median * 1000, min(timings) * 1000, args.runs, args.budget))
+    failed = False
+    if loaded:
+        sys.stdout.write('FAIL: --msg path imported ' + loaded + '\n')
+        failed = True
+    if median * 1000 > args.budget:
+        sys.stdout.write('FAIL: over budget\n')
+        failed = True
+    return 1 if failed else 0
+
+
+def legacy_clean_msg(same):
+    """clean_msg as of 0.3.2.0, for comparison"""
+    valid_chars = ''.join([string.ascii_uppercase, string.digits, '+-/*'])
+    same = same.upper()
+    msgidx = same.find('ZCZC')
+    if msgidx != -1:
+        same = same[msgidx:]
+    same = ''.join(same.split())
+    same = ''.join(filter(lambda x: x in valid_chars, same))
+    slen = len(same) - 1
+    if same[slen] != '-':
+        ridx = same.rfind('-')
+        offset = slen - ridx
+        if offset <= 8:
+            same = ''.join([same.ljust(slen + (8 - offset) + 1, '?'), '-'])
+    return same
+
+
+def clean(args):
+    import random
+    import dsame
+    rng = random.Random(0)
+    noise = ''.join(rng.choice(string.printable + '\x7f~^`|') for _ in range(300))
+    lines = {
+        'clean': 'EAS: ' + HEADER + '\n',
+        'noisy': 'EAS: ' + ''.join(c + rng.choice('~`^|{} \t') for c in HEADER.lower()) + '\n',
+        'garbage': noise + HEADER + noise + '\n',
+    }
+    sys.stdout.write('%-8s %6s %12s %12s %12s\n' % ('line', 'bytes', 'legacy us', 'str us', 'bytes us'))
+    for name, line in lines.items():
+        raw = line.encode('ascii')
+        legacy = legacy_clean_msg(line)
+        # The legacy version only dropped the text before ZCZC when ZCZC survived the noise uncleaned
+        assert dsame.clean_msg(line) == dsame.clean_msg(raw) == legacy[legacy.find('ZCZC'):], name
+        legacy = min(timeit.repeat(lambda: legacy_clean_msg(line), number=args.number, repeat=5)) / args.number
+        new = min(timeit.repeat(lambda: dsame.clean_msg(line), number=args.number, repeat=5)) / args.number
+        new_raw = min(timeit.repeat(lambda: dsame.clean_msg(raw), number=args.number, repeat=5)) / args.number
+        sys.stdout.write('%-8s %6d %12.2f %12.2f %12.2f\n' % (name, len(raw), legacy * 1e6, new * 1e6, new_raw * 1e6))
+    return 0
+
+
+def legacy_readable_message(ORG='WXR', EEE='RWT', PSSCCC=None, TTTT='0030', JJJHHMM='0010000', STATION=None,
+                            TYPE=None, LLLLLLLL=None, COUNTRY='US', LANG='EN'):
+    """readable_message as of 0.3.2.0 (without printing), for comparison"""
+    from dsame import format_message, county_decode, get_division, get_location
+    location = get_location(STATION, TYPE)
+    MSG = [format_message(defs.MSG__TEXT[LANG]['MSG1'], ORG=ORG, EEE=EEE, TTTT=TTTT, JJJHHMM=JJJHHMM, STATION=STATION,
+                          TYPE=TYPE, COUNTRY=COUNTRY, LANG=LANG,
+                          article=defs.MSG__TEXT[LANG][defs.SAME__ORG[LANG][ORG]['ARTICLE'][COUNTRY]].title(),
+                          has=defs.MSG__TEXT[LANG]['HAS'] if not defs.SAME__ORG[LANG][ORG]['PLURAL'] else
+                          defs.MSG__TEXT[LANG]['HAVE'],
+                          preposition=defs.MSG__TEXT[LANG]['IN'] if location != '' else '')]
+    current_state = None
+    for idx, item in enumerate(PSSCCC):
+        county, state = county_decode(item, COUNTRY, LANG)
+        if current_state != state:
+            DIVISION = get_division(PSSCCC[idx][1:3], COUNTRY, LANG)
+            output = defs.MSG__TEXT[LANG]['MSG2'].format(conjunction='' if idx == 0 else defs.MSG__TEXT[LANG]['AND'],
+                                                         state=state, division=DIVISION)
+            MSG += [''.join(output)]
+            current_state = state
+        MSG += [defs.MSG__TEXT[LANG]['MSG3'].format(
+            county=county if county != state else defs.MSG__TEXT[LANG]['ALL'].upper(),
+            punc=',' if idx != len(PSSCCC) - 1 else '.')]
+    MSG += [defs.MSG__TEXT[LANG]['MSG4']]
+    MSG += [''.join(['(', LLLLLLLL, ')'])]
+    return ''.join(MSG)
+
+
+def render(args):
+    import dsame
+    import fips
+    from header import parse_header
+    calls = []
+    for same in CORPUS:
+        header = parse_header(dsame.clean_msg(same))[0]
+        COUNTRY, bad_list = fips.detect_country(header.PSSCCC)
+        PSSCCC = sorted(code for code in header.PSSCCC if code not in bad_list)
+        for LANG in defs.MSG__TEXT:
+            calls.append((header.ORG, header.EEE, PSSCCC, header.TTTT, header.JJJHHMM, header.STATION, header.TYPE,
+                          header.LLLLLLLL, COUNTRY, LANG))
+    for call in calls:
+        assert dsame.render_message(*call) == legacy_readable_message(*call), call
+
+    def run(function):
+        for call in calls:
+            function(*call)
+
+    legacy = min(timeit.repeat(lambda: run(legacy_readable_message), number=args.number, repeat=5))
+    new = min(timeit.repeat(lambda: run(dsame.render_message), number=args.number, repeat=5))
+    count = len(calls) * args.number
+    sys.stdout.write('%d headers x %d languages: legacy %.1f us, compiled %.1f us per message (%.1fx)\n'
+                     % (len(CORPUS), len(defs.MSG__TEXT), legacy / count * 1e6, new / count * 1e6, legacy / new))
+    return 0
+
+
+def batch(args):
+    import contextlib
+    import io
+    import dsame
+    from batch import decode_batch
+    # A log of distinct alerts, each corpus header issued at a different time. One in REPEAT_EVERY is logged again
+    # as the demodulator printed it, the same header behind a different prefix
+    lines = []
+    for issue in range(args.repeat):
+        JJJHHMM = '%03d%02d%02d' % (1 + issue % 365, issue // 365 % 24, issue // 8760 % 60)
+        for same in CORPUS:
+            codes, times = same.split('+')
+            TTTT, _, station = times.split('-', 2)
+            same = '-'.join([codes + '+' + TTTT, JJJHHMM, station])
+            lines.append(same + ': ')
+            if len(lines) % REPEAT_EVERY == 0:
+                lines.append('EAS: ' + same)
+    context = dsame.DecoderContext(cache_size=0, dedup_window=0)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in lines:
+            dsame.same_decode(line, context)
+    legacy = time.perf_counter() - start
+    start = time.perf_counter()
+    results = decode_batch(lines, workers=args.workers)
+    new = time.perf_counter() - start
+    assert not [result for result in results if result.error], 'corpus header failed to decode'
+    sys.stdout.write('%d lines: same_decode %.1f ms, decode_batch %.1f ms (%.1fx)\n'
+                     % (len(lines), legacy * 1000, new * 1000, legacy / new))
+    return 0
+
+
+def legacy_alert_end(JJJHHMM, TTTT):
+    """alert_end as of 0.3.2.0, for comparison"""
+    import calendar
+    import datetime
+    utc_dt = datetime.datetime.strptime(JJJHHMM, '%j%H%M').replace(datetime.datetime.now(datetime.UTC).year)
+    timestamp = calendar.timegm(utc_dt.timetuple())
+    return datetime.datetime.fromtimestamp(timestamp) + datetime.timedelta(hours=int(TTTT[:2]), minutes=int(TTTT[2:]))
+
+
+def times(args):
+    import sametime
+    from header import parse_header
+    headers = [parse_header(same)[0] for same in CORPUS if len(parse_header(same)[0].JJJHHMM) == 7]
+
+    def run(function):
+        for header in headers:
+            function(header.JJJHHMM, header.TTTT)
+
+    legacy = min(timeit.repeat(lambda: run(legacy_alert_end), number=args.number, repeat=5))
+    new = min(timeit.repeat(lambda: run(sametime.end_epoch), number=args.number, repeat=5))
+    count = len(headers) * args.number
+    sys.stdout.write('alert end: strptime %.2f us, arithmetic %.2f us per header (%.1fx)\n'
+                     % (legacy / count * 1e6, new / count * 1e6, legacy / new))
+    return 0
+
+
+def gate(args):
+    import numpy as np
+    from demod import SameDemodulator, modulate
+    from framer import SameFramer
+    from gate import ActivityGate
+    rate, block = args.rate, args.block
+    rng = np.random.default_rng(0)
+    t = np.arange(int(rate * args.seconds)) / rate
+    # Program audio: a swelling tone, a steady tone off the SAME frequencies and noise
+    idle = (0.2 * np.sin(2 * np.pi * 440 * t) * np.sin(np.pi * t) + 0.1 * np.sin(2 * np.pi * 1200 * t)
+            + 0.05 * rng.standard_normal(len(t)))
+    burst = np.concatenate((modulate(HEADER, rate), np.zeros(rate)))
+    active = np.tile(burst, int(len(t) // len(burst)) + 1)[:len(t)] + 0.05 * rng.standard_normal(len(t))
+
+    def run(audio, gated):
+        demodulator, framer = SameDemodulator(rate), SameFramer()
+        activity = ActivityGate(rate) if gated else None
+        headers = 0
+        start = time.process_time()
+        for i in range(0, len(audio), block):
+            blocks = [audio[None, i:i + block]]
+            if activity:
+                blocks = activity.process(blocks[0])
+            for b in blocks:
+                headers += len(framer.feed(demodulator.process_channels(b)[0]))
+        return (time.process_time() - start) * 3600 / args.seconds, headers
+
+    sys.stdout.write('%-8s %18s %18s\n' % ('input', 'demod s/ch-hour', 'gated s/ch-hour'))
+    for name, audio in (('idle', idle), ('active', active)):
+        (plain, plain_headers), (gated, gated_headers) = run(audio, False), run(audio, True)
+        assert plain_headers == gated_headers, 'the gate lost a header'
+        sys.stdout.write('%-8s %18.1f %18.1f\n' % (name, plain, gated))
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], prog='benchmark',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter, epilog=__doc__)
+    commands = parser.add_subparsers(dest='benchmark', required=True)
+    p = commands.add_parser('startup', help='time a cold --msg run')
+    p.add_argument('--runs', type=int, default=10, help='number of runs')
+    p.add_argument('--budget', type=float, default=250.0, help='maximum median time in milliseconds')
+    p.set_defaults(func=startup)
+    p = commands.add_parser('clean', help='time clean_msg')
+    p.add_argument('--number', type=int, default=10000, help='calls per timing')
+    p.set_defaults(func=clean)
+    p = commands.add_parser('render', help='time readable_message')
+    p.add_argument('--number', type=int, default=200, help='passes over the corpus per timing')
+    p.set_defaults(func=render)
+    p = commands.add_parser('batch', help='time decode_batch')
+    p.add_argument('--repeat', type=int, default=1000, help='passes over the corpus')
+    p.add_argument('--workers', type=int, default=1, help='decode_batch worker processes')
+    p.set_defaults(func=batch)
+    p = commands.add_parser('times', help='time the alert start and end calculation')
+    p.add_argument('--number', type=int, default=2000, help='passes over the corpus per timing')
+    p.set_defaults(func=times)
+    p = commands.add_parser('gate', help='CPU per channel-hour with and without the activity gate')
+    p.add_argument('--seconds', type=float, default=60.0, help='seconds of audio to simulate')
+    p.add_argument('--rate', type=int, default=44100, help='sample rate')
+    p.add_argument('--block', type=int, default=4096, help='samples per block')
+    p.set_defaults(func=gate)
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
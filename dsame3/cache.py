@@ -0,0 +1,62 @@
+"""Small LRU cache with optional expiry.
+
+Alerts come back: the copies and relays of an alert are still shown within the dedup window (only recording, --call
+and --json are held back), and weather radio repeats warnings in its broadcast cycle. same_decode keeps the country,
+the cleaned location codes and the rendered areas here, keyed on the alert rather than the station (dedup.alert_key),
+so a repeat or a relay skips country detection and area rendering and only the station's part of the message is built
+again.
+"""
+import collections
+import time
+
+SIZE = 128
+TTL = 3600.0
+
+
+class LRUCache:
+    """Least recently used cache. Entries older than ttl seconds are dropped on lookup, size 0 disables the cache"""
+
+    def __init__(self, size=SIZE, ttl=TTL, clock=time.monotonic):
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl and self.clock() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.size <= 0:
+            return
+        self.entries[key] = (self.clock(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """Return the counters as a dict"""
+        lookups = self.hits + self.misses
+        return {'size': len(self.entries), 'max_size': self.size, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'expired': self.expired,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
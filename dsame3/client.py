@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Send a SAME message to a running dsame decode service and print the readable text.
+
+Start the service once with ``dsame.py --daemon`` and point samedec (or any other demodulator) at this script
+instead of ``dsame.py --msg``. Only the standard library is imported here so a call costs little more than the
+interpreter start. If no service is listening, the message is decoded by running dsame.py directly.
+"""
+import argparse
+import os
+import platform
+import subprocess
+import sys
+
+ACTIVE = 'ACTIVE'  # Request for the alerts in effect instead of a message
+
+
+def default_address():
+    """Return the named pipe (Windows) or Unix socket path used when no address is given."""
+    if platform.system() == 'Windows':
+        return r'\\.\pipe\dsame'
+    return os.path.join(os.environ.get('TMPDIR', '/tmp'), 'dsame.sock')
+
+
+def decode(msg, address=None):
+    """Send a message to the decode service and return its output."""
+    from multiprocessing.connection import Client
+    with Client(address or default_address()) as conn:
+        conn.send_bytes(msg.encode('utf-8'))
+        return conn.recv_bytes().decode('utf-8')
+
+
+def active(fips=None, address=None):
+    """Return the alerts the decode service has seen that are still in effect, one header per line."""
+    return decode(' '.join(filter(None, [ACTIVE, fips])), address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0], prog='dsame-client')
+    parser.add_argument('msg', nargs='?', default=os.environ.get('SAMEDEC_MSG'),
+                        help='message to decode (default: $SAMEDEC_MSG, as set by samedec)')
+    parser.add_argument('--address', help='decode service address (default: ' + default_address() + ')')
+    parser.add_argument('--active', nargs='?', const='', metavar='FIPS',
+                        help='list the alerts in effect instead, optionally only those covering one county')
+    args = parser.parse_args()
+    if args.active is not None:
+        sys.stdout.write(active(args.active or None, args.address))
+        return
+    if not args.msg:
+        parser.error('no message given')
+    try:
+        output = decode(args.msg, args.address)
+    except (OSError, EOFError):
+        # No service running, fall back to a one-shot decode
+        dsame = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dsame.py')
+        sys.exit(subprocess.call([sys.executable, dsame, '--skip_dependency', '--msg', args.msg]))
+    sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Duplicate header suppression.
+
+Every SAME header is sent three times, and one alert is passed on by every neighbouring transmitter and EAS
+participant. DuplicateFilter remembers the alerts seen in the last `window` seconds, keyed on
+(ORG, EEE, sorted PSSCCC, JJJHHMM, TTTT), so recording, --call and --json happen once per alert.
+"""
+import collections
+import time
+
+NEW = 'new'
+DUPLICATE = 'duplicate'
+RELAY = 'relay from different station'
+
+WINDOW = 900.0
+SIZE = 1024
+
+
+def alert_key(header):
+    """Return the part of a SameHeader that identifies the alert, whichever station sent it"""
+    return header.ORG, header.EEE, tuple(sorted(header.PSSCCC)), header.JJJHHMM, header.TTTT
+
+
+class DuplicateFilter:
+    """Give each header a verdict: NEW, DUPLICATE (same station again) or RELAY (same alert, another station).
+
+    An alert stays known while it keeps being heard: each copy restarts its window. At most size alerts are kept,
+    the one heard longest ago is forgotten first. A window of 0 turns the filter off.
+    """
+
+    def __init__(self, window=WINDOW, size=SIZE, clock=time.monotonic):
+        self.window = window
+        self.size = size
+        self.clock = clock
+        self.alerts = collections.OrderedDict()  # alert key -> (last heard, stations), least recently heard first
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def expire(self, now):
+        while self.alerts:
+            key, (heard, stations) = next(iter(self.alerts.items()))
+            if now - heard <= self.window:
+                break
+            del self.alerts[key]
+
+    def check(self, header):
+        if not self.window or self.size <= 0:
+            return NEW
+        now = self.clock()
+        self.expire(now)
+        key = alert_key(header)
+        entry = self.alerts.pop(key, None)
+        if entry is None:
+            stations, verdict = {header.LLLLLLLL}, NEW
+        elif header.LLLLLLLL in entry[1]:
+            stations, verdict = entry[1], DUPLICATE
+        else:
+            stations, verdict = entry[1] | {header.LLLLLLLL}, RELAY
+        self.alerts[key] = (now, stations)
+        while len(self.alerts) > self.size:
+            self.alerts.popitem(last=False)
+        return verdict
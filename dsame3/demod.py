@@ -0,0 +1,156 @@
+"""SAME AFSK demodulator.
+
+SAME bursts are 520.83 baud AFSK: a 1 bit is four cycles of 2083.3 Hz (mark), a 0 bit three cycles of 1562.5 Hz
+(space). Each burst starts with sixteen 0xAB preamble bytes, and bytes are sent least significant bit first.
+
+SameDemodulator takes audio blocks of any size (sounddevice buffers, rtl_fm output, a WAV file read in pieces) and
+returns the characters decoded from them, ending each burst with a newline, ready for framer.SameFramer:
+
+    demod = SameDemodulator(48000)
+    for kind, text in framer.feed(demod.process(block)):
+        same_decode(text, context)
+
+Several inputs are demodulated together by giving the number of channels and passing (channels, samples) blocks to
+process_channels(), which returns the characters of each channel.
+
+The mark and space correlators are computed for the whole block, all channels at once, with NumPy: the block is
+mixed down with both tones and summed over one bit with a running sum. Only the bit clock of each channel, which
+runs 521 times a second, is stepped in Python.
+"""
+import numpy as np
+
+BAUD = 520.83
+MARK = 2083.3
+SPACE = 1562.5
+PREAMBLE = 0xAB
+CLOCK_GAIN = 0.5  # How far the bit clock is pulled towards each transition
+VALID = frozenset(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+-/ ?')
+
+
+class BitSync:
+    """Bit clock recovery and byte framing for one channel"""
+
+    def __init__(self, samples_per_bit):
+        self.samples_per_bit = samples_per_bit
+        self.next_bit = samples_per_bit  # Sample position of the next bit decision
+        self.last = 0.0  # Last discriminator value, to find transitions across blocks
+        self.register = 0  # Bits of the byte being received, newest at the top
+        self.bits = 0
+        self.state = 'hunt'  # hunt for the preamble, then preamble, then data
+
+    def process(self, d, start):
+        """Take the decisions falling in d, the discriminator from sample position start, and return the bytes"""
+        end = start + len(d)
+        signs = np.signbit(np.concatenate(([self.last], d)))
+        transitions = np.flatnonzero(signs[1:] != signs[:-1]) + start
+        self.last = d[-1]
+        out = bytearray()
+        half = self.samples_per_bit / 2
+        t = 0
+        while self.next_bit < end:
+            while t < len(transitions) and transitions[t] < self.next_bit:
+                # Transitions should fall half a bit before a decision
+                self.next_bit += CLOCK_GAIN * (transitions[t] + half - self.next_bit)
+                t += 1
+            if self.next_bit >= end:
+                break
+            self.receive(d[max(int(self.next_bit) - start, 0)] > 0, out)
+            self.next_bit += self.samples_per_bit
+        return bytes(out)
+
+    def receive(self, bit, out):
+        self.register = (self.register >> 1) | (0x80 if bit else 0)
+        if self.state == 'hunt':
+            if self.register == PREAMBLE:
+                self.state, self.bits = 'preamble', 0
+            return
+        self.bits += 1
+        if self.bits < 8:
+            return
+        byte, self.bits = self.register, 0
+        if byte == PREAMBLE:
+            self.state = 'data' if self.state == 'preamble' else self.state
+        elif self.state == 'data' and byte in VALID:
+            out.append(byte)
+        else:
+            # Lost the signal (or a false preamble in noise), end the burst and hunt again
+            if self.state == 'data':
+                out += b'\n'
+            self.state = 'hunt'
+
+    def end(self):
+        out = b'\n' if self.state == 'data' else b''
+        self.state = 'hunt'
+        return out
+
+
+class SameDemodulator:
+    """Stateful demodulator for one or more audio streams with the same sample rate"""
+
+    def __init__(self, sample_rate, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.samples_per_bit = sample_rate / BAUD
+        self.window = int(round(self.samples_per_bit))
+        tones = np.array([MARK, SPACE])
+        self.step = 2 * np.pi * tones / sample_rate  # Radians per sample of each tone
+        self.phase = np.zeros(2)
+        # Mixed samples still in the window, by channel and tone
+        self.history = np.zeros((channels, 2, self.window - 1), dtype=np.complex128)
+        self.oscillators = {}
+        self.position = 0  # Samples seen so far
+        self.sync = [BitSync(self.samples_per_bit) for _ in range(channels)]
+
+    def oscillator(self, length):
+        osc = self.oscillators.get(length)
+        if osc is None:
+            osc = self.oscillators[length] = np.exp(-1j * np.outer(self.step, np.arange(length)))
+        return osc
+
+    def discriminate(self, block):
+        """Return mark minus space energy over the last bit for every sample of every channel in the block"""
+        length = block.shape[1]
+        osc = self.oscillator(length) * np.exp(-1j * self.phase)[:, None]
+        self.phase = (self.phase + self.step * length) % (2 * np.pi)
+        mixed = np.concatenate((self.history, block[:, None, :] * osc), axis=2)
+        total = np.cumsum(mixed, axis=2)
+        window = total[:, :, self.window - 1:].copy()
+        window[:, :, 1:] -= total[:, :, :length - 1]
+        self.history = mixed[:, :, -(self.window - 1):]
+        energy = window.real ** 2 + window.imag ** 2
+        return energy[:, 0] - energy[:, 1]
+
+    def process_channels(self, block):
+        """Demodulate a (channels, samples) block and return a list of the bytes decoded on each channel"""
+        block = np.asarray(block, dtype=np.float64)
+        if not block.shape[1]:
+            return [b''] * self.channels
+        d = self.discriminate(block)
+        start = self.position
+        self.position += block.shape[1]
+        return [sync.process(d[channel], start) for channel, sync in enumerate(self.sync)]
+
+    def process(self, block):
+        """Demodulate a block of mono samples and return the decoded bytes"""
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim > 1:
+            block = block.mean(axis=1)  # Mix sounddevice (frames, channels) blocks down to mono
+        return self.process_channels(block[None, :])[0]
+
+    def flush_channels(self):
+        """Return the last bits of each channel at the end of the audio, ending bursts that were cut off"""
+        out = self.process_channels(np.zeros((self.channels, 2 * self.window)))
+        return [text + sync.end() for text, sync in zip(out, self.sync)]
+
+    def flush(self):
+        return self.flush_channels()[0]
+
+
+def modulate(text, sample_rate, preamble=16, amplitude=0.5):
+    """Return a SAME burst (preamble and text) as samples, for tests and benchmarks"""
+    data = bytes([PREAMBLE]) * preamble + text.encode('ascii')
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8), bitorder='little')
+    count = int(len(bits) * sample_rate / BAUD)
+    index = np.minimum((np.arange(count) * BAUD / sample_rate).astype(int), len(bits) - 1)
+    frequency = np.where(bits[index] == 1, MARK, SPACE)
+    return amplitude * np.sin(np.cumsum(2 * np.pi * frequency / sample_rate))
@@ -0,0 +1,109 @@
+"""Concurrent, resumable downloads for the dependency checker.
+
+Files are fetched on a bounded thread pool into ``<name>.part`` and only renamed into place once their size (and
+SHA-256, when the server or caller provides one) has been checked. An interrupted download is picked up where it
+stopped with an HTTP Range request.
+"""
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+import urllib.error
+import urllib.request
+
+CHUNK_SIZE = 1024 * 1024
+WORKERS = 4
+TIMEOUT = 30
+
+
+class DownloadError(Exception):
+    pass
+
+
+class LinkedETagHandler(urllib.request.HTTPRedirectHandler):
+    """Keep the X-Linked-ETag (the SHA-256 of a Hugging Face LFS file) from the redirect to the file itself"""
+    linked_etag = None
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        etag = headers.get('X-Linked-ETag')
+        if etag:
+            self.linked_etag = etag.strip('"').split(':')[-1]
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+def sha256(path):
+    """Return the SHA-256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_total(response, offset):
+    """Return the full size of the file being sent, or None if the server does not say"""
+    match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+    if match:
+        return int(match.group(1))
+    length = response.headers.get('Content-Length')
+    return int(length) + offset if length is not None else None
+
+
+def download(url, path, expected_sha256=None, progress=None, timeout=TIMEOUT):
+    """Download url to path, resuming a previous partial download if there is one"""
+    part = path + '.part'
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    handler = LinkedETagHandler()
+    opener = urllib.request.build_opener(handler)
+    request = urllib.request.Request(url, headers={'Range': 'bytes=%d-' % offset} if offset else {})
+    try:
+        response = opener.open(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable. Either the partial file is already complete, or it is not the same file
+        if e.headers.get('Content-Range', '') != 'bytes */%d' % offset:
+            os.remove(part)
+            return download(url, path, expected_sha256, progress, timeout)
+        response = None
+    if response is None:
+        total = offset
+        if progress:
+            progress(offset, total)
+    else:
+        with response:
+            if offset and response.status != 206:
+                offset = 0  # Server ignored the range, start over
+            total = content_total(response, offset)
+            if progress:
+                progress(offset, total or 0)
+            with open(part, 'ab' if offset else 'wb') as f:
+                for block in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    f.write(block)
+                    if progress:
+                        progress(len(block))
+    size = os.path.getsize(part)
+    if total is not None and size != total:
+        raise DownloadError('%s is incomplete (%d of %d bytes), it will be resumed next time' % (url, size, total))
+    expected_sha256 = expected_sha256 or handler.linked_etag
+    if expected_sha256 and len(expected_sha256) == 64 and sha256(part) != expected_sha256.lower():
+        os.remove(part)
+        raise DownloadError('%s failed the SHA-256 check' % url)
+    os.replace(part, path)
+    logging.debug(' '.join(['Downloaded >', path, str(size), 'bytes']))
+    return path
+
+
+def download_all(jobs, workers=WORKERS, progress=None, timeout=TIMEOUT):
+    """Download (url, path[, sha256]) jobs concurrently and return a list of (url, error) for the ones that failed"""
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download, job[0], job[1], job[2] if len(job) > 2 else None, progress, timeout): job[0]
+                   for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except (OSError, DownloadError) as detail:
+                failed.append((futures[future], detail))
+    return failed
@@ -22,44 +22,65 @@
 # IMPLEMENT CONFIGURATION FILE TO AVOID REQUIRING THE USER TO CALL WITH ARGUMENTS
 # JUST REPLACE THE ARGS WITH THE CONFIG FILE DATA VARIABLES
 
-import multiprocessing
 import platform
 import sys
-from tqdm import tqdm
 import defs
+import client
+import cache
+import dedup
+import fips
+import recorder
+import registry
+import sametime
+import vote
+from framer import CLEAN_DELETE, CLEAN_TABLE, SameFramer
+from header import HeaderError, parse_header
+import watch
 import argparse
-import string
 import logging
 import datetime
 import subprocess
-import sounddevice as sd
-import soundfile as sf
-import numpy as np
+import contextlib
+import io
 import os.path
-from faster_whisper import WhisperModel
 import time
 import shutil
-import urllib.request
-from urllib import request
-from zipfile import ZipFile
+
+# Audio modules, imported by load_audio() only when audio is read or recorded. The --msg path never needs them;
+# sounddevice (and PortAudio with it) is imported only where a stream is opened, so audio files decode without it.
+# multiprocessing, tqdm, urllib.request, zipfile and faster_whisper are imported by the functions that use them.
+sf = None
+np = None
 
 # Constants
 SAMPLE_RATE = 44100  # Sample rate (Hz)
+RTL_SAMPLE_RATE = 22050  # rtl_fm output sample rate (Hz)
+MULTIMON_SAMPLE_RATE = 22050  # multimon-ng raw input sample rate (Hz)
 CHANNELS = 2  # Number of audio channels
+TRANSCRIBE_SAMPLE_RATE = 16000  # Sample rate faster-whisper works at (Hz)
+PREROLL_SECONDS = 15.0  # Input kept for the start of recordings, enough for three long header bursts
 FILE_NAME = 'recording.wav'  # Output file name
 FILE_NAME_PATH = ''
 
 # Recording state
 is_recording = 0
 file = None
-stream = None
+recording = None  # recorder.AlertRecorder of the alert being recorded
+preroll = None  # preroll.PreRollCapture feeding recordings, when the input is kept open
 same1 = None
 message1 = None
 
-# Callback function for audio input
-recorded_frames = []
 MODEL_PATH = os.path.join(os.path.abspath(''), 'Model')
 RESTART_QUEUE = False
+INTERNET = None
+
+# Dependency manifest. Written after a successful online dependency check so later launches only need to stat the
+# files and tools it lists, and the network is only touched when it is missing, stale or out of date.
+MANIFEST_PATH = os.path.join(os.path.abspath(''), 'dependencies.json')
+MANIFEST_MAX_AGE = 7 * 24 * 60 * 60  # Seconds before the online check is repeated
+MODEL_URL = 'https://huggingface.co/guillaumekln/faster-whisper-{model}/resolve/main/{name}'
+MODEL_FILES = ['model.bin', 'config.json', 'tokenizer.json', 'vocabulary.txt']
+TOOLS = {'multimon-ng': ['-h'], 'ffmpeg': ['-version'], 'rtl_fm': ['-h']}
 
 eventWarning = ["AVW", "BHW", "BWW", "BZW", "CDW", "CEM", "CFW", "CHW", "CWW", "DBW", "DEW", "DSW", "EAN", "EQW", "EVI",
                 "EWW", "FCW", "FFW", "FLW", "FRW", "FSW", "FZW", "HMW", "HUW", "HWW", "IBW", "IFW", "LAE", "LEW", "LSW",
@@ -90,25 +111,43 @@ def my_hook(t):
     return update_to
 
 
-class TqdmUpTo(tqdm):
-    """Alternative Class-based version of the above.
-    Provides `update_to(n)` which uses `tqdm.update(delta_n)`.
-    Inspired by [twine#242](https://github.com/pypa/twine/pull/242),
-    [here](https://github.com/pypa/twine/commit/42e55e06).
-    """
+TqdmUpTo = None
 
-    def update_to(self, b=1, bsize=1, tsize=None):
-        """
-        b  : int, optional
-            Number of blocks transferred so far [default: 1].
-        bsize  : int, optional
-            Size of each block (in tqdm units) [default: 1].
-        tsize  : int, optional
-            Total size (in tqdm units). If [default: None] remains unchanged.
-        """
-        if tsize is not None:
-            self.total = tsize
-        self.update(b * bsize - self.n)  # will also set self.n = b * bsize
+
+def tqdm_up_to(**kwargs):
+    """Create a TqdmUpTo progress bar, defining the class the first time tqdm is needed"""
+    global TqdmUpTo
+    if TqdmUpTo is None:
+        from tqdm import tqdm
+
+        class TqdmUpTo(tqdm):
+            """Alternative Class-based version of the above.
+            Provides `update_to(n)` which uses `tqdm.update(delta_n)`.
+            Inspired by [twine#242](https://github.com/pypa/twine/pull/242),
+            [here](https://github.com/pypa/twine/commit/42e55e06).
+            """
+
+            def update_to(self, b=1, bsize=1, tsize=None):
+                """
+                b  : int, optional
+                    Number of blocks transferred so far [default: 1].
+                bsize  : int, optional
+                    Size of each block (in tqdm units) [default: 1].
+                tsize  : int, optional
+                    Total size (in tqdm units). If [default: None] remains unchanged.
+                """
+                if tsize is not None:
+                    self.total = tsize
+                self.update(b * bsize - self.n)  # will also set self.n = b * bsize
+    return TqdmUpTo(**kwargs)
+
+
+def load_audio():
+    """Import the audio modules the first time audio is read or recorded"""
+    global sf, np
+    if sf is None:
+        import soundfile as sf
+        import numpy as np
 
 
 # NEED TO IMPLEMENT (maybe) SoX
@@ -118,11 +157,15 @@ class TqdmUpTo(tqdm):
 
 # noinspection PyBroadException
 def internet_on():
-    try:
-        request.urlopen('https://google.com', timeout=4)
-        return True
-    except Exception:
-        return False
+    global INTERNET
+    if INTERNET is None:
+        from urllib import request
+        try:
+            request.urlopen('https://google.com', timeout=4)
+            INTERNET = True
+        except Exception:
+            INTERNET = False
+    return INTERNET
 
 
 def os_clear():
@@ -135,6 +178,8 @@ def os_clear():
 # noinspection PyBroadException
 def dependency_check_rtl():
     if internet_on():
+        import urllib.request
+        from zipfile import ZipFile
         PLATFORM = platform.system()
         if PLATFORM == 'Windows':
             home_directory = os.path.expanduser('~')
@@ -146,8 +191,8 @@ def dependency_check_rtl():
                 if not os.path.exists(os.path.abspath('') + '\\Temp'):
                     os.makedirs(os.path.abspath('') + '\\Temp')
                 # sys.stdout.write("Downloading RTL-SDR Windows Binary ZIP File. \n")
-                with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                              desc='Downloading RTL-SDR Windows Binary ZIP File', ascii=' █') as t:
+                with tqdm_up_to(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
+                                desc='Downloading RTL-SDR Windows Binary ZIP File', ascii=' █') as t:
                     urllib.request.urlretrieve(
                         url="https://github.com/rtlsdrblog/rtl-sdr-blog/releases/download/1.01/Release.zip",
                         filename=os.path.abspath('') + '\\Temp\\Release.zip',
@@ -188,6 +233,8 @@ def dependency_check_rtl():
 # noinspection PyBroadException
 def dependency_check_ffmpeg():
     if internet_on():
+        import urllib.request
+        from zipfile import ZipFile
         PLATFORM = platform.system()
         if PLATFORM == 'Windows':
             # sys.stdout.write(PLATFORM + '\n')
@@ -200,8 +247,8 @@ def dependency_check_ffmpeg():
                 if not os.path.exists(os.path.abspath('') + '\\Temp'):
                     os.makedirs(os.path.abspath('') + '\\Temp')
                 # sys.stdout.write("Downloading FFMPEG Windows Binary ZIP File. \n")
-                with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                              desc='Downloading FFMPEG Windows Binary ZIP File', ascii=' █') as t:
+                with tqdm_up_to(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
+                                desc='Downloading FFMPEG Windows Binary ZIP File', ascii=' █') as t:
                     urllib.request.urlretrieve(
                         url="https://github.com/BtbN/FFmpeg-Builds/releases/download/latest/ffmpeg-master-latest-win64"
                             "-gpl.zip",
@@ -244,6 +291,8 @@ def dependency_check_ffmpeg():
 # noinspection PyBroadException
 def dependency_check_multimon():
     if internet_on():
+        import urllib.request
+        from zipfile import ZipFile
         PLATFORM = platform.system()
         if PLATFORM == 'Windows':
             # sys.stdout.write(PLATFORM + '\n')
@@ -256,8 +305,8 @@ def dependency_check_multimon():
                 if not os.path.exists(os.path.abspath('') + '\\Temp'):
                     os.makedirs(os.path.abspath('') + '\\Temp')
                 # sys.stdout.write("Downloading Multimon-NG Windows Binary ZIP File. \n")
-                with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                              desc='Downloading Multimon-NG Windows Binary ZIP File', ascii=' █') as t:
+                with tqdm_up_to(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
+                                desc='Downloading Multimon-NG Windows Binary ZIP File', ascii=' █') as t:
                     urllib.request.urlretrieve(
                         url="https://github.com/cuppa-joe/multimon-ng/releases/download/WIN32-0415/multimon-ng-WIN32"
                             ".zip",
@@ -294,54 +343,135 @@ def dependency_check_multimon():
                          'ensure all dependencies are properly installed. \n')
 
 
-def dependency_check_model(MODEL_NAME):
+def required_models(args):
+    """Return the models transcribe_alert_faster can load with these arguments"""
+    if not args.transcribe:
+        return []
+    if args.transcription_model == 'large':
+        return ['large-v2']
+    if args.lang.upper() == 'EN':
+        return [args.transcription_model + '.en']
+    return [args.transcription_model]
+
+
+def dependency_check_models(models):
+    if not models:
+        return
     if internet_on():
-        if not os.path.exists(os.path.join(MODEL_PATH, MODEL_NAME)):
-            sys.stdout.write("Model path does not exist for " + MODEL_NAME + ". Creating folders and downloading files. \n")
-            os.makedirs(os.path.join(MODEL_PATH, MODEL_NAME))
-        if not os.path.exists(os.path.join(MODEL_PATH, MODEL_NAME, 'model.bin')):
-            # sys.stdout.write("Downloading model.bin for model " + MODEL_NAME + ". \n")
-            with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                          desc="Downloading model.bin for model " + MODEL_NAME, ascii=' █') as t:
-                urllib.request.urlretrieve(
-                    url="https://huggingface.co/guillaumekln/faster-whisper-" + MODEL_NAME + "/resolve/main/model.bin",
-                    filename=os.path.join(MODEL_PATH, MODEL_NAME, 'model.bin'),
-                    reporthook=t.update_to)
-        if not os.path.exists(os.path.join(MODEL_PATH, MODEL_NAME, 'config.json')):
-            # sys.stdout.write("Downloading config.json for model " + MODEL_NAME + ". \n")
-            with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                          desc="Downloading config.json for model " + MODEL_NAME, ascii=' █') as t:
-                urllib.request.urlretrieve(
-                    url="https://huggingface.co/guillaumekln/faster-whisper-" + MODEL_NAME + "/resolve/main/config.json",
-                    filename=os.path.join(MODEL_PATH, MODEL_NAME, 'config.json'),
-                    reporthook=t.update_to)
-        if not os.path.exists(os.path.join(MODEL_PATH, MODEL_NAME, 'tokenizer.json')):
-            # sys.stdout.write("Downloading tokenizer.json for model " + MODEL_NAME + ". \n")
-            with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                          desc="Downloading tokenizer.json for model " + MODEL_NAME, ascii=' █') as t:
-                urllib.request.urlretrieve(
-                    url="https://huggingface.co/guillaumekln/faster-whisper-" + MODEL_NAME + "/resolve/main/tokenizer.json",
-                    filename=os.path.join(MODEL_PATH, MODEL_NAME, 'tokenizer.json'),
-                    reporthook=t.update_to)
-        if not os.path.exists(os.path.join(MODEL_PATH, MODEL_NAME, 'vocabulary.txt')):
-            # sys.stdout.write("Downloading vocabulary.txt for model " + MODEL_NAME + ". \n")
-            with TqdmUpTo(unit='B', unit_scale=True, unit_divisor=1024, miniters=1,
-                          desc="Downloading vocabulary.txt for model " + MODEL_NAME, ascii=' █') as t:
-                urllib.request.urlretrieve(
-                    url="https://huggingface.co/guillaumekln/faster-whisper-" + MODEL_NAME + "/resolve/main/vocabulary.txt",
-                    filename=os.path.join(MODEL_PATH, MODEL_NAME, 'vocabulary.txt'),
-                    reporthook=t.update_to)
-        #sys.stdout.write('All dependencies are installed and up to date for model ' + MODEL_NAME + '. \n')
+        import threading
+        import downloader
+        jobs = []
+        for model in models:
+            if not os.path.exists(os.path.join(MODEL_PATH, model)):
+                sys.stdout.write("Model path does not exist for " + model + ". Creating folders and downloading "
+                                 "files. \n")
+                os.makedirs(os.path.join(MODEL_PATH, model))
+            for name in MODEL_FILES:
+                if not os.path.exists(os.path.join(MODEL_PATH, model, name)):
+                    jobs.append((MODEL_URL.format(model=model, name=name), os.path.join(MODEL_PATH, model, name)))
+        if not jobs:
+            return
+
+        lock = threading.Lock()
+        with tqdm_up_to(unit='B', unit_scale=True, unit_divisor=1024, miniters=1, total=0, ascii=' █',
+                        desc="Downloading " + str(len(jobs)) + " files for model " + ', '.join(models)) as t:
+            def progress(n, total=0):
+                with lock:
+                    if total:
+                        t.total += total
+                        t.refresh()
+                    t.update(n)
+
+            failed = downloader.download_all(jobs, progress=progress)
+        for url, detail in failed:
+            sys.stdout.write('MODEL DEPENDENCY CHECK ERROR: ' + url + ' could not be downloaded. ' + str(detail) +
+                             '\n')
     else:
-        sys.stdout.write(MODEL_NAME + 'MODEL DEPENDENCY CHECK ERROR: This device seems disconnected from the internet. '
-                                      'Dependency checks cannot be conducted. This may cause unexpected program '
-                                      'behavior. Please connect your device to the internet as soon as possible to '
-                                      'ensure all dependencies are properly installed. \n')
+        sys.stdout.write(', '.join(models) + ' MODEL DEPENDENCY CHECK ERROR: This device seems disconnected from '
+                                            'the internet. Dependency checks cannot be conducted. This may cause '
+                                            'unexpected program behavior. Please connect your device to the internet as '
+                                            'soon as possible to ensure all dependencies are properly installed. \n')
+
+
+def file_stat(path):
+    """Return the size and modification time of a file, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return {'size': st.st_size, 'mtime': st.st_mtime_ns}
+
+
+# noinspection PyBroadException
+def tool_version(name):
+    """Return the path and version banner of an external tool, or None if it is not on the PATH"""
+    path = shutil.which(name)
+    if path is None:
+        return None
+    try:
+        result = subprocess.run([path] + TOOLS[name], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, timeout=10)
+        version = result.stdout.decode('utf-8', 'replace').strip().splitlines()[0]
+    except Exception:
+        version = ''
+    return dict(file_stat(path), path=path, version=version)
 
 
-# noinspection PyUnusedLocal
-def callback(indata, data, frames, status):
-    recorded_frames.append(indata.copy())
+# noinspection PyBroadException
+def read_manifest(path=MANIFEST_PATH):
+    """Return the dependency manifest, or None if it is missing or unreadable"""
+    import json
+    try:
+        with open(path) as infile:
+            return json.load(infile)
+    except Exception:
+        return None
+
+
+def write_manifest(models, path=MANIFEST_PATH):
+    """Record the installed model files and tools after an online dependency check"""
+    import json
+    import downloader
+    previous = (read_manifest(path) or {}).get('files', {})
+    files = {}
+    for model in models:
+        for name in MODEL_FILES:
+            key = model + '/' + name
+            stat = file_stat(os.path.join(MODEL_PATH, key))
+            if stat is None:
+                continue
+            if key in previous and {'size': previous[key]['size'], 'mtime': previous[key]['mtime']} == stat:
+                files[key] = previous[key]  # Unchanged, no need to hash it again
+            else:
+                files[key] = dict(stat, sha256=downloader.sha256(os.path.join(MODEL_PATH, key)))
+    manifest = {'version': defs.VERSION, 'checked': time.time(), 'models': models, 'files': files,
+                'tools': {name: tool_version(name) for name in TOOLS}}
+    with open(path, 'w') as outfile:
+        json.dump(manifest, outfile, indent=1)
+
+
+def manifest_current(models, path=MANIFEST_PATH, max_age=MANIFEST_MAX_AGE):
+    """Check the dependency manifest against the disk without touching the network"""
+    manifest = read_manifest(path)
+    if manifest is None:
+        return False
+    if manifest.get('version') != defs.VERSION or time.time() - manifest.get('checked', 0) > max_age:
+        return False
+    files = manifest.get('files', {})
+    for model in models:
+        for name in MODEL_FILES:
+            key = model + '/' + name
+            if key not in files or file_stat(os.path.join(MODEL_PATH, key)) != \
+                    {'size': files[key]['size'], 'mtime': files[key]['mtime']}:
+                logging.debug(' '.join(['Dependency manifest out of date >', key]))
+                return False
+    for name, tool in manifest.get('tools', {}).items():
+        if tool is None:
+            continue
+        if file_stat(tool['path']) != {'size': tool['size'], 'mtime': tool['mtime']}:
+            logging.debug(' '.join(['Dependency manifest out of date >', name]))
+            return False
+    return True
 
 
 # noinspection PyUnusedLocal,PyShadowingNames
@@ -371,7 +501,8 @@ def int_or_str(text):
 
 
 def transcribe_alert_faster(transcribe_path, transcription_model, message, FILE_NAME_PATH_LOCAL1, FILE_NAME_LOCAL,
-                            message12, lang, compute, beam, device):
+                            message12, lang, compute, beam, device, trim=False):
+    from faster_whisper import WhisperModel
     start_time = time.time()
     global MODEL_PATH
     sys.stdout.write('Transcription started. \n')
@@ -387,7 +518,17 @@ def transcribe_alert_faster(transcribe_path, transcription_model, message, FILE_
     else:
         model = WhisperModel(model_size_or_path=str(os.path.join(MODEL_PATH, str(transcription_model))), device=device,
                              compute_type=compute)
-    segments, info = model.transcribe(os.path.join(FILE_NAME_PATH_LOCAL, FILE_NAME_LOCAL), beam_size=beam)
+    audio = os.path.join(FILE_NAME_PATH_LOCAL, FILE_NAME_LOCAL)
+    if trim:
+        # Only the voice message, not the bursts and attention signal around it
+        from faster_whisper import decode_audio
+        import tones
+        audio = decode_audio(audio, sampling_rate=TRANSCRIBE_SAMPLE_RATE)
+        start, end = tones.message_span(tones.find_tones(audio, TRANSCRIBE_SAMPLE_RATE), len(audio),
+                                        TRANSCRIBE_SAMPLE_RATE)
+        if end > start:
+            audio = audio[start:end]
+    segments, info = model.transcribe(audio, beam_size=beam)
     logging.debug("Detected language '%s' with probability %f" % (info.language, info.language_probability))
     text = ''
     for segment in segments:
@@ -422,8 +563,11 @@ def set_FILE_NAME(alert, path):
 
 
 def alert_start(JJJHHMM, format1='%j%H%M'):
-    import calendar
     """Convert EAS date string to datetime format"""
+    if format1 == '%j%H%M' and len(JJJHHMM) == 7:
+        return datetime.datetime.fromtimestamp(sametime.start_epoch(JJJHHMM))
+    # Short or differently formatted date codes are still read the lenient strptime way
+    import calendar
     utc_dt = datetime.datetime.strptime(JJJHHMM, format1).replace(datetime.datetime.now(datetime.UTC).year)
     timestamp = calendar.timegm(utc_dt.timetuple())
     return datetime.datetime.fromtimestamp(timestamp)
@@ -524,12 +668,11 @@ def get_division(input1, COUNTRY='US', LANG='EN'):
     return DIVISION
 
 
-def get_event(input1):
+def get_event(input1, LANG='EN'):
     event = None
-    args = parse_arguments()
     # noinspection PyBroadException
     try:
-        if args.lang == 'SP':
+        if LANG == 'SP':
             event = defs.SAME__EEE__SP[input1]
         else:
             event = defs.SAME__EEE[input1]
@@ -557,14 +700,13 @@ def printf(output=''):
 
 
 def alert_end(JJJHHMM, TTTT):
-    alertstart = alert_start(JJJHHMM)
-    delta = datetime.timedelta(hours=int(TTTT[:2]), minutes=int(TTTT[2:]))
-    return alertstart + delta
+    if len(JJJHHMM) == 7:
+        return datetime.datetime.fromtimestamp(sametime.end_epoch(JJJHHMM, TTTT))
+    return alert_start(JJJHHMM) + datetime.timedelta(seconds=sametime.purge_seconds(TTTT))
 
 
 def alert_length(TTTT):
-    delta = datetime.timedelta(hours=int(TTTT[:2]), minutes=int(TTTT[2:]))
-    return delta.seconds
+    return sametime.purge_seconds(TTTT)
 
 
 def get_location(STATION=None, TYPE=None):
@@ -580,17 +722,8 @@ def get_location(STATION=None, TYPE=None):
 
 
 def check_watch(watch_list, PSSCCC_list, event_list, EEE):
-    if not watch_list:
-        watch_list = PSSCCC_list
-    if not event_list:
-        event_list = [EEE]
-    w, p = [], []
-    w += [item[1:] for item in watch_list]
-    p += [item[1:] for item in PSSCCC_list]
-    if (set(w) & set(p)) and EEE in event_list:
-        return True
-    else:
-        return False
+    """One-off watch check. same_decode uses the WatchFilter compiled into its DecoderContext"""
+    return bool(watch.WatchFilter(watch_list, event_list).match(PSSCCC_list, EEE))
 
 
 def kwdict(**kwargs):
@@ -602,54 +735,107 @@ def format_message(command, ORG='WXR', EEE='RWT', PSSCCC=None, TTTT='0030', JJJH
     if PSSCCC is None:
         PSSCCC = []
     return command.format(ORG=ORG, EEE=EEE, TTTT=TTTT, JJJHHMM=JJJHHMM, STATION=STATION, TYPE=TYPE, LLLLLLLL=LLLLLLLL,
-                          COUNTRY=COUNTRY, LANG=LANG, event=get_event(EEE), type=get_indicator(EEE),
+                          COUNTRY=COUNTRY, LANG=LANG, event=get_event(EEE, LANG), type=get_indicator(EEE),
                           end=fn_dt(alert_end(JJJHHMM, TTTT)), start=fn_dt(alert_start(JJJHHMM)),
                           organization=defs.SAME__ORG[LANG][ORG]['NAME'][COUNTRY], PSSCCC='-'.join(PSSCCC),
                           location=get_location(STATION, TYPE), date=fn_dt(datetime.datetime.now(), '%c'),
                           length=get_length(TTTT), seconds=alert_length(TTTT), MESSAGE=MESSAGE, **kwargs)
 
 
-def readable_message(ORG='WXR', EEE='RWT', PSSCCC=None, TTTT='0030', JJJHHMM='0010000', STATION=None, TYPE=None,
-                     LLLLLLLL=None, COUNTRY='US', LANG='EN'):
+class PartialFormat(dict):
+    """format_map mapping that leaves unknown fields in place, to fill a template in two steps"""
+
+    def __missing__(self, key):
+        return ''.join(['{', key, '}'])
+
+
+# readable_message templates, compiled on first use. MESSAGE_TEMPLATES holds MSG1 with the article, organization
+# and verb filled in per (LANG, COUNTRY, ORG); LOCATION_PHRASES holds the state heading and county phrases per
+# (LANG, COUNTRY, PSSCCC) so repeated codes are never decoded twice.
+MESSAGE_TEMPLATES = {}
+LOCATION_PHRASES = {}
+
+
+def compile_message(LANG, COUNTRY, ORG):
+    """Return the MSG1 template for a language, country and originator, leaving location, event and time open"""
+    TEXT = defs.MSG__TEXT[LANG]
+    organization = defs.SAME__ORG[LANG][ORG]
+    return TEXT['MSG1'].format_map(PartialFormat(
+        article=TEXT[organization['ARTICLE'][COUNTRY]].title(), organization=organization['NAME'][COUNTRY],
+        has=TEXT['HAS'] if not organization['PLURAL'] else TEXT['HAVE']))
+
+
+def compile_location(item, COUNTRY, LANG):
+    """Return the state, the state heading (first, following) and the county phrase (more follow, last) of a code"""
+    TEXT = defs.MSG__TEXT[LANG]
+    county, state = county_decode(item, COUNTRY, LANG)
+    DIVISION = get_division(item[1:3], COUNTRY, LANG)
+    county = county if county != state else TEXT['ALL'].upper()
+    return (state,
+            tuple(TEXT['MSG2'].format(conjunction=conjunction, state=state, division=DIVISION)
+                  for conjunction in ('', TEXT['AND'])),
+            tuple(TEXT['MSG3'].format(county=county, punc=punc) for punc in (',', '.')))
+
+
+def render_message(ORG='WXR', EEE='RWT', PSSCCC=None, TTTT='0030', JJJHHMM='0010000', STATION=None, TYPE=None,
+                   LLLLLLLL=None, COUNTRY='US', LANG='EN'):
+    """Return the readable text of a header without printing it"""
     if PSSCCC is None:
         PSSCCC = []
-    import re
+    return render_station(ORG, EEE, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL, COUNTRY, LANG,
+                          render_areas(PSSCCC, COUNTRY, LANG))
+
+
+def render_station(ORG, EEE, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL, COUNTRY, LANG, areas):
+    """Return the readable text of a header around its already rendered areas, the part that depends on the
+    sending station"""
+    key = (LANG, COUNTRY, ORG)
+    template = MESSAGE_TEMPLATES.get(key)
+    if template is None:
+        template = MESSAGE_TEMPLATES[key] = compile_message(LANG, COUNTRY, ORG)
+    TEXT = defs.MSG__TEXT[LANG]
     location = get_location(STATION, TYPE)
-    MSG = [format_message(defs.MSG__TEXT[LANG]['MSG1'], ORG=ORG, EEE=EEE, TTTT=TTTT, JJJHHMM=JJJHHMM, STATION=STATION,
-                          TYPE=TYPE, COUNTRY=COUNTRY, LANG=LANG,
-                          article=defs.MSG__TEXT[LANG][defs.SAME__ORG[LANG][ORG]['ARTICLE'][COUNTRY]].title(),
-                          has=defs.MSG__TEXT[LANG]['HAS'] if not defs.SAME__ORG[LANG][ORG]['PLURAL'] else
-                          defs.MSG__TEXT[LANG]['HAVE'],
-                          preposition=defs.MSG__TEXT[LANG]['IN'] if location != '' else '')]
+    return ''.join([template.format(location=location, preposition=TEXT['IN'] if location != '' else '',
+                                    event=get_event(EEE, LANG), end=fn_dt(alert_end(JJJHHMM, TTTT))),
+                    areas, TEXT['MSG4'], '(', LLLLLLLL, ')'])
+
+
+def render_areas(PSSCCC, COUNTRY, LANG):
+    """Return the states and counties part of the readable text"""
+    MSG = []
     current_state = None
+    last = len(PSSCCC) - 1
     for idx, item in enumerate(PSSCCC):
-        county, state = county_decode(item, COUNTRY, LANG)
+        key = (LANG, COUNTRY, item)
+        phrases = LOCATION_PHRASES.get(key)
+        if phrases is None:
+            phrases = LOCATION_PHRASES[key] = compile_location(item, COUNTRY, LANG)
+        state, headings, counties = phrases
         if current_state != state:
-            DIVISION = get_division(PSSCCC[idx][1:3], COUNTRY, LANG)
-            output = defs.MSG__TEXT[LANG]['MSG2'].format(conjunction='' if idx == 0 else defs.MSG__TEXT[LANG]['AND'],
-                                                         state=state, division=DIVISION)
-            MSG += [''.join(output)]
+            MSG.append(headings[idx != 0])
             current_state = state
-        MSG += [defs.MSG__TEXT[LANG]['MSG3'].format(
-            county=county if county != state else defs.MSG__TEXT[LANG]['ALL'].upper(),
-            punc=',' if idx != len(PSSCCC) - 1 else '.')]
-    MSG += [defs.MSG__TEXT[LANG]['MSG4']]
-    MSG += [''.join(['(', LLLLLLLL, ')'])]
-    final_str = ''.join(MSG)
+        MSG.append(counties[idx == last])
+    return ''.join(MSG)
+
+
+def readable_message(ORG='WXR', EEE='RWT', PSSCCC=None, TTTT='0030', JJJHHMM='0010000', STATION=None, TYPE=None,
+                     LLLLLLLL=None, COUNTRY='US', LANG='EN'):
+    final_str = render_message(ORG, EEE, PSSCCC, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL, COUNTRY, LANG)
     printf(final_str)
     return final_str
 
 
+# clean_msg translation: upper-case letters, keep A-Z 0-9 + - / * and delete every other byte, whitespace included
 def clean_msg(same):
-    valid_chars = ''.join([string.ascii_uppercase, string.digits, '+-/*'])
-    same = same.upper()  # Uppercase
+    """Return the valid SAME characters of a demodulator line (str or raw bytes) as an upper-case string"""
+    if isinstance(same, str):
+        same = same.encode('ascii', 'ignore')
+    same = same.translate(CLEAN_TABLE, CLEAN_DELETE).decode('ascii')  # Uppercase, valid ASCII codes only
     msgidx = same.find('ZCZC')
-    if msgidx != -1:
+    if msgidx > 0:
         same = same[msgidx:]  # Left Offset
-    same = ''.join(same.split())  # Remove whitespace
-    same = ''.join(filter(lambda x: x in valid_chars, same))  # Valid ASCII codes only
     slen = len(same) - 1
-    if same[slen] != '-':
+    if msgidx != -1 and same[slen] != '-':
         ridx = same.rfind('-')
         offset = slen - ridx
         if offset <= 8:
@@ -658,182 +844,193 @@ def clean_msg(same):
     return same
 
 
-def same_decode(same, lang, same_watch=None, event_watch=None, text=True, call=None, command=None, jsonfile=None):
-    args = parse_arguments()
-    global file, stream, recorded_frames, same1, message1
+def alert_expired(alert):
+    logging.info(' '.join(['      Alert expired >', str(alert.header)]))
+
+
+def expiry_timeout(context, timeout=None):
+    """Return the seconds to wait for input before the next alert in effect expires, or timeout if that is sooner.
+    None waits forever"""
+    expiry = context.registry.next_expiry()
+    if expiry is not None:
+        remaining = max(0.0, expiry - context.registry.clock())
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return timeout
+
+
+def print_active(context, fips=None):
+    """Write the alerts still in effect, with their purge times, optionally only those covering one county"""
+    for alert in context.registry.active(fips):
+        sys.stdout.write(' '.join([str(alert.header), fn_dt(datetime.datetime.fromtimestamp(alert.end), '%c')]) + '\n')
+
+
+class DecoderContext:
+    """Decoder settings, created once by main() (or a library caller) and passed to same_decode"""
+
+    def __init__(self, lang='EN', same_watch=None, event_watch=None, text=True, call=None, command=None,
+                 jsonfile=None, source=None, record=None, transcribe=None, transcription_model='medium',
+                 transcription_device='cpu', transcription_compute='float32', transcription_beam_size=5,
+                 cache_size=cache.SIZE, cache_ttl=cache.TTL, dedup_window=dedup.WINDOW, trim=True,
+                 vote=True):
+        self.lang = lang.upper()
+        self.same_watch = same_watch
+        self.event_watch = event_watch
+        self.watch = watch.WatchFilter(same_watch, event_watch)
+        self.text = text
+        self.call = call
+        self.command = command
+        self.jsonfile = jsonfile
+        self.source = source
+        self.record = record
+        self.trim = trim
+        self.vote = vote
+        self.transcribe = transcribe
+        self.transcription_model = transcription_model
+        self.transcription_device = transcription_device
+        self.transcription_compute = transcription_compute
+        self.transcription_beam_size = transcription_beam_size
+        self.cache = cache.LRUCache(cache_size, cache_ttl)
+        self.dedup = dedup.DuplicateFilter(dedup_window)
+        self.registry = registry.AlertRegistry(on_expire=alert_expired)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(lang=args.lang, same_watch=args.same, event_watch=args.event, text=args.text, call=args.call,
+                   command=args.command, jsonfile=args.json, source=args.source, record=args.record,
+                   transcribe=args.transcribe, transcription_model=args.transcription_model,
+                   transcription_device=args.transcription_device, transcription_compute=args.transcription_compute,
+                   transcription_beam_size=args.transcription_beam_size, cache_size=args.cache_size,
+                   cache_ttl=args.cache_ttl, dedup_window=args.dedup_window, trim=args.trim,
+                   vote=args.vote)
+
+
+def same_decode(same, context, channel=None, confidence=None):
+    global file, recording, same1, message1
+    same = clean_msg(same)
     while len(same):
         # noinspection PyUnusedLocal
         tail = same
-        # noinspection PyBroadException
-        try:
-            same = clean_msg(same)
-        except:
-            return
         msgidx = same.find('ZCZC')
         endidx = same.find('NNNN')
         if msgidx != -1 and (endidx == -1 or endidx > msgidx):
             # New message
             logging.debug('-' * 30)
             logging.debug(' '.join(['    Identifer found >', 'ZCZC']))
-            # noinspection PyUnusedLocal
-            S1, S2 = None, None
-            # noinspection PyBroadException
-            try:
-                S1, S2 = same[msgidx:].split('+', 1)
-            except:
-                format_error()
-                return
-            # noinspection PyBroadException
             try:
-                ZCZC, ORG, EEE, PSSCCC = S1.split('-', 3)
-            except:
-                format_error()
+                header, end = parse_header(same, msgidx)
+            except HeaderError as detail:
+                format_error(str(detail))
                 return
+            ORG, EEE, TTTT, JJJHHMM = header.ORG, header.EEE, header.TTTT, header.JJJHHMM
+            LLLLLLLL, STATION, TYPE = header.LLLLLLLL, header.STATION, header.TYPE
+            PSSCCC = '-'.join(header.PSSCCC)
+            PSSCCC_list = list(header.PSSCCC)
+            tail = same[end:]
             logging.debug(' '.join(['   Originator found >', ORG]))
             logging.debug(' '.join(['   Event Code found >', EEE]))
-            # noinspection PyBroadException
-            try:
-                PSSCCC_list = PSSCCC.split('-')
-            except:
-                format_error()
-            # noinspection PyBroadException
-            try:
-                TTTT, JJJHHMM, LLLLLLLL, tail = S2.split('-', 3)
-            except:
-                format_error()
-                return
             logging.debug(' '.join(['   Purge Time found >', TTTT]))
             logging.debug(' '.join(['    Date Code found >', JJJHHMM]))
             logging.debug(' '.join(['Location Code found >', LLLLLLLL]))
-            # noinspection PyBroadException
-            try:
-                STATION, TYPE = LLLLLLLL.split('/')
-            except ValueError:
-                # Station doesn't have to have a /
-                STATION = LLLLLLLL
-                TYPE = None
-                pass
-            except:
-                STATION, TYPE = None, None
-                format_error()
-            # noinspection PyUnboundLocalVariable
             logging.debug(' '.join(['   SAME Codes found >', str(len(PSSCCC_list))]))
-            US_bad_list = []
-            CA_bad_list = []
-            MX_bad_list = []
-            for code in PSSCCC_list:
-                try:
-                    # noinspection PyUnusedLocal
-                    county = defs.US_SAME_CODE[code[1:]]
-                except KeyError:
-                    US_bad_list.append(code)
-                try:
-                    # noinspection PyUnusedLocal
-                    county = defs.CA_SAME_CODE[code[1:]]
-                except KeyError:
-                    CA_bad_list.append(code)
+            verdict = context.dedup.check(header)
+            logging.info(' '.join(['            Verdict >', verdict]))
+            if channel is not None:
+                logging.info(' '.join(['            Channel >', str(channel)]))
+            if confidence is not None:
+                logging.info(' '.join(['         Confidence >', str(confidence)]))
+            try:
+                context.registry.add(header)
+            except ValueError as detail:
+                logging.debug(' '.join(['    Not registered >', str(detail)]))
+            # Keyed on the alert, not the station: a relay or a later rebroadcast reuses the areas
+            key = (dedup.alert_key(header), context.lang, context.text)
+            rendered = context.cache.get(key)
+            if rendered is None:
+                COUNTRY, bad_list = fips.detect_country(PSSCCC_list)
+                logging.debug(' '.join(['Invalid Codes found >', str(len(bad_list)), ', '.join(bad_list)]))
+                logging.debug(' '.join(['            Country >', COUNTRY]))
+                logging.debug('-' * 30)
+                for code in bad_list:
+                    PSSCCC_list.remove(code)
+                PSSCCC_list.sort()
+                watched = context.watch.match(PSSCCC_list, EEE)
+                logging.debug(' '.join(['      Watched areas >', ', '.join(watched)]))
+                areas = render_areas(PSSCCC_list, COUNTRY, context.lang) if watched and context.text else None
+                context.cache.put(key, (COUNTRY, PSSCCC_list, watched, areas))
+            else:
+                COUNTRY, PSSCCC_list, watched, areas = rendered
+                logging.debug(' '.join(['   Render cache hit >', COUNTRY]))
+                logging.debug('-' * 30)
+            MESSAGE, data = None, None
+            if watched and context.text:
+                MESSAGE = render_station(ORG, EEE, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL, COUNTRY, context.lang,
+                                         areas)
+            if watched and context.jsonfile and verdict == dedup.NEW:
                 try:
-                    # noinspection PyUnusedLocal
-                    county = defs.MX_SAME_CODE[code[1:]]
-                except KeyError:
-                    MX_bad_list.append(code)
-            if len(US_bad_list) < len(CA_bad_list) and len(US_bad_list) < len(MX_bad_list):
-                COUNTRY = 'US'
-            if len(US_bad_list) > len(CA_bad_list) and len(CA_bad_list) < len(MX_bad_list):
-                COUNTRY = 'CA'
-            if len(US_bad_list) > len(MX_bad_list) and len(CA_bad_list) > len(MX_bad_list):
-                COUNTRY = 'MX'
-            if len(US_bad_list) == len(MX_bad_list) and len(US_bad_list) == len(CA_bad_list):
-                if type == 'CA':
-                    COUNTRY = 'CA'
-                elif type == 'MX':
-                    COUNTRY = 'MX'
-                else:
-                    COUNTRY = 'US'
-            # noinspection PyUnboundLocalVariable
-            if COUNTRY == 'CA':
-                bad_list = CA_bad_list
-            elif COUNTRY == 'MX':
-                bad_list = MX_bad_list
-            elif COUNTRY == 'US':
-                bad_list = US_bad_list
-            # noinspection PyUnboundLocalVariable
-            logging.debug(' '.join(['Invalid Codes found >', str(len(bad_list)), ', '.join(bad_list)]))
-            logging.debug(' '.join(['            Country >', COUNTRY]))
-            logging.debug('-' * 30)
-            for code in bad_list:
-                PSSCCC_list.remove(code)
-            PSSCCC_list.sort()
-            if check_watch(same_watch, PSSCCC_list, event_watch, EEE):
-                if text:
-                    MESSAGE = readable_message(ORG, EEE, PSSCCC_list, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL, COUNTRY,
-                                               lang)
+                    data = kwdict(ORG=ORG, EEE=EEE, TTTT=TTTT, JJJHHMM=JJJHHMM, STATION=STATION, TYPE=TYPE,
+                                  LLLLLLLL=LLLLLLLL, COUNTRY=COUNTRY, LANG=context.lang,
+                                  event=get_event(EEE, context.lang),
+                                  type=get_indicator(EEE), end=fn_dt(alert_end(JJJHHMM, TTTT)),
+                                  start=fn_dt(alert_start(JJJHHMM)),
+                                  organization=defs.SAME__ORG[context.lang][ORG]['NAME'][COUNTRY], PSSCCC=PSSCCC,
+                                  PSSCCC_list=PSSCCC_list, location=get_location(STATION, TYPE),
+                                  date=None, length=get_length(TTTT),
+                                  seconds=alert_length(TTTT), MESSAGE=MESSAGE, watched=list(watched))
+                except Exception as detail:
+                    logging.error(detail)
+                    return
+            if watched:
+                if context.text:
+                    printf(MESSAGE if channel is None else ' '.join(['[channel %d]' % channel, MESSAGE]))
+                if verdict != dedup.NEW:
+                    # Already handled this alert: shown again, but not recorded, called or written out again
+                    same = tail
+                    continue
+                if context.text:
                     message1 = MESSAGE
-                    same1 = str(same)
-                    if args.record:
-                        """and not args.source == 'rtl' will be removed once a way to record the SDR stream is found"""
-                        if not is_recording and not args.source == 'file':
-                            if args.source == 'rtl':
-                                sys.stdout.write('rtl\n')
-                            else:
-                                # Start recording
-
-                                sys.stdout.write('Recording started. ')
-                                set_is_recording(1)
-                                set_FILE_NAME(EEE, args.record)
-                                sys.stdout.write(FILE_NAME_PATH + FILE_NAME)
-                                sys.stdout.write('\n')
-                                stream = sd.InputStream(callback=callback, channels=CHANNELS, samplerate=SAMPLE_RATE)
-                                stream.start()
-                else:
-                    MESSAGE = None
-                    same1 = str(same)
-                    if args.record:
-                        """and not args.source == 'rtl' will be removed once a way to record the SDR stream is found"""
-                        if not is_recording and not args.source == 'file':
-                            if args.source == 'rtl':
-                                sys.stdout.write('rtl\n')
-                            else:
-                                # Start recording
-                                sys.stdout.write('Recording started. ')
-                                set_is_recording(1)
-                                set_FILE_NAME(EEE, args.record)
-                                sys.stdout.write(FILE_NAME_PATH + FILE_NAME)
-                                sys.stdout.write('\n')
-                                stream = sd.InputStream(callback=callback, channels=CHANNELS, samplerate=SAMPLE_RATE)
-                                stream.start()
-                if jsonfile:
+                same1 = str(same)
+                if context.record:
+                    """and not args.source == 'rtl' will be removed once a way to record the SDR stream is found"""
+                    if not is_recording and not context.source == 'file':
+                        if context.source == 'rtl':
+                            sys.stdout.write('rtl\n')
+                        else:
+                            # Start recording
+                            sys.stdout.write('Recording started. ')
+                            set_is_recording(1)
+                            set_FILE_NAME(EEE, context.record)
+                            sys.stdout.write(FILE_NAME_PATH + FILE_NAME)
+                            sys.stdout.write('\n')
+                            recording = start_recording(TTTT, context)
+                if context.jsonfile:
                     try:
                         import json
-                        data = kwdict(ORG=ORG, EEE=EEE, TTTT=TTTT, JJJHHMM=JJJHHMM, STATION=STATION, TYPE=TYPE,
-                                      LLLLLLLL=LLLLLLLL, COUNTRY=COUNTRY, LANG=lang, event=get_event(EEE),
-                                      type=get_indicator(EEE), end=fn_dt(alert_end(JJJHHMM, TTTT)),
-                                      start=fn_dt(alert_start(JJJHHMM)),
-                                      organization=defs.SAME__ORG[lang][ORG]['NAME'][COUNTRY], PSSCCC=PSSCCC,
-                                      PSSCCC_list=PSSCCC_list, location=get_location(STATION, TYPE),
-                                      date=fn_dt(datetime.datetime.now(), '%c'), length=get_length(TTTT),
-                                      seconds=alert_length(TTTT), MESSAGE=MESSAGE)
-                        with open(jsonfile, 'w') as outfile:
-                            json.dump(data, outfile)
+                        with open(context.jsonfile, 'w') as outfile:
+                            record = dict(data, date=fn_dt(datetime.datetime.now(), '%c'))
+                            if channel is not None:
+                                record['channel'] = channel
+                            if confidence is not None:
+                                record['confidence'] = confidence
+                            json.dump(record, outfile)
                     except Exception as detail:
                         logging.error(detail)
                         return
-                if command:
-                    if call:
+                if context.command:
+                    if context.call:
                         l_cmd = []
-                        for cmd in command:
+                        for cmd in context.command:
                             l_cmd.append(
                                 format_message(cmd, ORG, EEE, PSSCCC_list, TTTT, JJJHHMM, STATION, TYPE, LLLLLLLL,
-                                               COUNTRY, lang, MESSAGE))
+                                               COUNTRY, context.lang, MESSAGE, channel=channel))
                         try:
-                            subprocess.call([call] + l_cmd)
+                            subprocess.call([context.call] + l_cmd)
                         except Exception as detail:
                             logging.error(detail)
                             return
                         pass
                     else:
-                        f_cmd = format_message(command, ORG, EEE, PSSCCC_list, TTTT, JJJHHMM, STATION, TYPE,
-                                               LLLLLLLL, COUNTRY, lang, MESSAGE)
+                        f_cmd = format_message(context.command, ORG, EEE, PSSCCC_list, TTTT, JJJHHMM, STATION, TYPE,
+                                               LLLLLLLL, COUNTRY, context.lang, MESSAGE)
                         #printf(f_cmd)
         else:
             if endidx == -1:
@@ -841,44 +1038,294 @@ def same_decode(same, lang, same_watch=None, event_watch=None, text=True, call=N
                 return
             else:
                 """and not args.source == 'rtl' will be removed once a way to record the SDR stream is found"""
-                if args.record and is_recording and not args.source == 'rtl':
-                    # RECORDING STOP
-                    stream.stop()
-                    stream.close()
-                    recorded_frames = np.concatenate(recorded_frames)
-                    # noinspection PyBroadException
-                    try:
-                        sf.write(FILE_NAME_PATH + FILE_NAME, recorded_frames, SAMPLE_RATE, 'PCM_24')
-                        sys.stdout.write('Recording stopped. File saved as ' + FILE_NAME_PATH + FILE_NAME + '\n')
-                        set_is_recording(0)
-                        recorded_frames = []
-                        try:
-                            if args.transcribe and not args.source == 'file':
-                                # noinspection PyUnboundLocalVariable
-                                background_process = multiprocessing.Process(name='background_process',
-                                                                             target=transcribe_alert_faster,
-                                                                             args=(args.transcribe,
-                                                                                   args.transcription_model, same1,
-                                                                                   FILE_NAME_PATH, FILE_NAME, message1,
-                                                                                   args.lang,
-                                                                                   args.transcription_compute,
-                                                                                   args.transcription_beam_size,
-                                                                                   args.transcription_device))
-                                background_process.daemon = True
-                                background_process.start()
-                        except Exception as e:
-                            sys.stdout.write('Error: ' + str(e) + '\n')
-                    except Exception as e:
-                        sys.stdout.write(
-                            'Error. Recording could not be saved. Please check your path and make sure it is '
-                            'correct and you have access. \n ERROR DETAILS: ' + str(e) + '\n')
-                        set_is_recording(0)
-                logging.debug(' '.join(['End of Message found >', 'NNNN', str(msgidx)]))
-                tail = same[msgidx:+len('NNNN')]
+                if context.record and is_recording and not context.source == 'rtl':
+                    # RECORDING STOP, the writer thread closes the file and calls recording_done
+                    recording.stop()
+                    set_is_recording(0)
+                logging.debug(' '.join(['End of Message found >', 'NNNN', str(endidx)]))
+                tail = same[endidx + len('NNNN'):]
         # Move ahead and look for more
         same = tail
 
 
+def start_recording(TTTT, context):
+    """Record the input to FILE_NAME_PATH + FILE_NAME until the end of message, for at most the purge time"""
+    folder, name, header, message = FILE_NAME_PATH, FILE_NAME, same1, message1
+    try:
+        max_seconds = sametime.purge_seconds(TTTT)
+    except ValueError:
+        max_seconds = 0  # Capped at recorder.MIN_SECONDS
+    load_audio()
+    new_recording = recorder.AlertRecorder(folder + name, SAMPLE_RATE, CHANNELS, max_seconds,
+                                           on_done=lambda done: recording_done(done, context, folder, name, header,
+                                                                               message))
+    if preroll is None:
+        return new_recording.start()
+    new_recording.start(stream=False)
+    preroll.attach(new_recording)
+    return new_recording
+
+
+def start_preroll(seconds, capture_hub=None):
+    """Feed recordings from a pre-roll of the input, so they start the given number of seconds before their header
+    was decoded. The audio comes from the capture hub, or from an input stream of its own"""
+    global preroll
+    import preroll as capture
+    load_audio()
+    preroll = capture.PreRollCapture(SAMPLE_RATE, CHANNELS, seconds)
+    if capture_hub is None:
+        preroll.start()
+    else:
+        capture_hub.add(preroll.process, CHANNELS, name='recorder')
+    logging.info('Pre-roll of %.1f s (%d bytes)', seconds, preroll.ring.nbytes)
+
+
+def start_capture(args, channels=1):
+    """Open the soundcard once for the demodulator, recorder, monitor and level meter. The caller adds the
+    demodulator and starts the hub"""
+    import hub
+    load_audio()
+    capture_hub = hub.CaptureHub(SAMPLE_RATE, max(channels, CHANNELS if args.record else 1))
+    if args.record:
+        start_preroll(args.preroll, capture_hub)
+    if args.monitor:
+        sys.stdout.write('MONITORING ENABLED\n')
+        capture_hub.add(hub.Monitor(SAMPLE_RATE, capture_hub.channels).play, name='monitor')
+    if args.meter:
+        capture_hub.add(hub.LevelMeter(SAMPLE_RATE, report_level).process, name='meter')
+    if args.shared_audio:
+        import atexit
+        import sharedring
+        shared = sharedring.SharedAudioRing(args.shared_audio, SAMPLE_RATE, capture_hub.channels)
+
+        def close_shared():
+            # Stop the callback first, it may be writing to the block
+            capture_hub.stop()
+            shared.close()
+
+        atexit.register(close_shared)
+        capture_hub.attach(shared)
+        logging.info(' '.join(['       Shared audio >', shared.name]))
+    return capture_hub
+
+
+def report_level(peak, rms):
+    logging.info('        Input level > peak %.1f dBFS, RMS %.1f dBFS', peak, rms)
+
+
+def multimon_feed(pipe):
+    """Return a capture hub consumer writing the input to multimon-ng as raw 16 bit mono"""
+    step = SAMPLE_RATE // MULTIMON_SAMPLE_RATE
+    carry = np.zeros(0, dtype=np.float32)
+
+    def feed(block):
+        nonlocal carry
+        mono = np.concatenate((carry, block.mean(axis=1)))
+        count = len(mono) // step * step
+        carry = mono[count:]
+        # Averaging each step samples filters a little before the rate is lowered
+        samples = mono[:count].reshape(-1, step).mean(axis=1)
+        pipe.write((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+        pipe.flush()
+
+    return feed
+
+
+def recording_done(done, context, folder, name, header, message):
+    """Finish a recording once its writer has closed the file (called on the writer thread)"""
+    if done.full or done.error is not None:
+        if recording is done:
+            set_is_recording(0)
+    if done.error is not None:
+        sys.stdout.write('Error. Recording could not be saved. Please check your path and make sure it is correct and '
+                         'you have access. \n ERROR DETAILS: ' + str(done.error) + '\n')
+        return
+    if done.full:
+        logging.warning('No end of message heard, recording stopped at the purge time.')
+    if done.dropped:
+        logging.warning('%d audio blocks were dropped while recording.', done.dropped)
+    if context.trim:
+        # noinspection PyBroadException
+        try:
+            trim_recording(done.path)
+        except Exception as e:
+            logging.error(e)
+    sys.stdout.write('Recording stopped. File saved as ' + done.path + '\n')
+    try:
+        if context.transcribe and not context.source == 'file':
+            import multiprocessing
+            background_process = multiprocessing.Process(name='background_process', target=transcribe_alert_faster,
+                                                         args=(context.transcribe, context.transcription_model,
+                                                               header, folder, name, message, context.lang,
+                                                               context.transcription_compute,
+                                                               context.transcription_beam_size,
+                                                               context.transcription_device, context.trim))
+            background_process.daemon = True
+            background_process.start()
+    except Exception as e:
+        sys.stdout.write('Error: ' + str(e) + '\n')
+
+
+def trim_recording(path, blocksize=65536):
+    """Cut a recording down to the alert, from its first SAME burst to the last end of message burst. The file is
+    read and copied in blocks"""
+    import tones
+    with sf.SoundFile(path) as audio:
+        detector = tones.AttentionToneDetector(audio.samplerate)
+        found = []
+        for block in audio.blocks(blocksize):
+            found += detector.process(block)
+        found += detector.flush()
+        for tone in found:
+            logging.debug('            Tone >   %s %.2f-%.2f s', tone.kind, tone.start, tone.end)
+        span = tones.alert_span(found, audio.frames, audio.samplerate)
+        if span is None:
+            logging.info('Recording not trimmed, no header bursts found before the message')
+            return
+        start, end = span
+        if end - start == audio.frames:
+            return
+        logging.info('Recording trimmed to %.2f-%.2f s of %.2f s', start / audio.samplerate, end / audio.samplerate,
+                     audio.frames / audio.samplerate)
+        trimmed = path + '.trim'
+        audio.seek(start)
+        with sf.SoundFile(trimmed, 'w', audio.samplerate, audio.channels, audio.subtype, format=audio.format) as out:
+            for block in audio.blocks(blocksize, frames=end - start):
+                out.write(block)
+    os.replace(trimmed, path)
+
+
+def decode_events(events, context, channel=None):
+    """Decode the (kind, text, confidence) events of a HeaderVoter"""
+    for kind, text, confidence in events:
+        try:
+            same_decode(text, context, channel, confidence)
+        except Exception:
+            # One header that cannot be decoded must not stop monitoring
+            logging.exception(' '.join(['Cannot decode >', text]))
+
+
+def decode_stream(read, context, size=4096):
+    """Decode demodulator output as it arrives, calling read(size) until it returns nothing. The reads happen on a
+    thread so the header voter can be polled while the source is quiet"""
+    import queue
+    import threading
+    framer = SameFramer()
+    voter = vote.HeaderVoter(vote.COPIES if context.vote else 1)
+    chunks = queue.Queue()
+
+    def reader():
+        for data in iter(lambda: read(size), b''):
+            chunks.put(data)
+        chunks.put(b'')
+
+    threading.Thread(target=reader, name='reader', daemon=True).start()
+    while True:
+        try:
+            chunk = chunks.get(timeout=expiry_timeout(context, voter.timeout()))
+        except queue.Empty:
+            decode_events(voter.poll(), context)
+            context.registry.expire()
+            continue
+        if not chunk:
+            break
+        logging.debug(chunk)
+        decode_events(voter.feed(framer.feed(chunk)), context)
+    decode_events(voter.feed(framer.close()) + voter.flush(), context)
+
+
+def demodulate(blocks, context, sample_rate, channels=1, gate=True):
+    """Decode SAME bursts from (channels, samples) blocks of audio with the built-in demodulator instead of
+    multimon-ng. With more than one channel, each is decoded separately and its alerts are tagged with the channel,
+    counting from 1.
+    The activity gate keeps the demodulator idle until SAME tones are heard"""
+    from demod import SameDemodulator
+    from gate import ActivityGate
+    demodulator = SameDemodulator(sample_rate, channels)
+    activity = ActivityGate(sample_rate) if gate else None
+    framers = [SameFramer() for _ in range(channels)]
+    # Voting runs on audio time, so files decoded faster than real time group their copies the same way
+    voters = [vote.HeaderVoter(vote.COPIES if context.vote else 1) for _ in range(channels)]
+    tag = (lambda channel: channel + 1) if channels > 1 else (lambda channel: None)
+    samples = 0
+    for block in blocks:
+        samples += block.shape[1]
+        now = samples / sample_rate
+        for active in activity.process(block) if activity else [block]:
+            for channel, text in enumerate(demodulator.process_channels(active)):
+                decode_events(voters[channel].feed(framers[channel].feed(text), now), context, tag(channel))
+        for channel, voter in enumerate(voters):
+            decode_events(voter.poll(now), context, tag(channel))
+        context.registry.expire()
+    for channel, text in enumerate(demodulator.flush_channels()):
+        events = voters[channel].feed(framers[channel].feed(text) + framers[channel].close(), samples / sample_rate)
+        decode_events(events + voters[channel].flush(), context, tag(channel))
+
+
+def file_blocks(path, channels=None, blocksize=65536):
+    """Yield (channels, samples) blocks of the first channels of an audio file, or of all of them mixed down to one
+    when channels is None"""
+    load_audio()
+    with sf.SoundFile(path) as f:
+        for block in f.blocks(blocksize=blocksize, always_2d=True):
+            yield block.mean(axis=1)[None, :] if channels is None else block[:, :channels].T
+
+
+def raw_blocks(read, size=8192):
+    """Yield (1, samples) blocks of signed 16-bit raw audio (as written by rtl_fm) from read(size)"""
+    load_audio()
+    carry = b''
+    for chunk in iter(lambda: read(size), b''):
+        chunk = carry + chunk
+        end = len(chunk) - len(chunk) % 2
+        carry = chunk[end:]
+        yield np.frombuffer(chunk[:end], dtype='<i2')[None, :] / 32768.0
+
+
+def serve(context, address):
+    """Decode messages sent by client.py until interrupted, so each alert does not start a new interpreter"""
+    import threading
+    from multiprocessing.connection import Listener
+    lock = threading.Lock()  # Held while a message is decoded, so expiry output never lands in a reply
+    wake = threading.Event()
+
+    def expire():
+        # Alerts expire on time while no message comes in, not only when the next one does
+        while True:
+            wake.wait(expiry_timeout(context))
+            wake.clear()
+            with lock:
+                context.registry.expire()
+
+    threading.Thread(target=expire, name='expiry', daemon=True).start()
+    if not address.startswith('\\\\') and os.path.exists(address):
+        os.remove(address)  # Stale socket from a previous run
+    with Listener(address) as listener:
+        sys.stdout.write('Decode service listening on ' + address + '\n')
+        while True:
+            try:
+                with listener.accept() as conn:
+                    msg = conn.recv_bytes().decode('utf-8', 'replace')
+                    logging.debug(msg)
+                    output = io.StringIO()
+                    try:
+                        with lock, contextlib.redirect_stdout(output):
+                            if msg.startswith(client.ACTIVE):
+                                print_active(context, msg[len(client.ACTIVE):].strip() or None)
+                            else:
+                                same_decode(msg, context)
+                        reply = output.getvalue()
+                    except Exception as detail:
+                        # One message that cannot be decoded must not stop the service
+                        logging.exception(' '.join(['Cannot decode >', msg]))
+                        reply = 'Error. cannot decode: ' + str(detail) + '\n'
+                    wake.set()  # The next purge time may have moved
+                    logging.debug(' '.join(['Render cache >', str(context.cache.stats())]))
+                    conn.send_bytes(reply.encode('utf-8'))
+            except (EOFError, OSError) as detail:
+                logging.error(detail)
+
+
 def parse_arguments():
     parser = argparse.ArgumentParser(description=defs.DESCRIPTION, prog=defs.PROGRAM, fromfile_prefix_chars='@')
     parser.add_argument('--msg', help='message to decode')
@@ -895,12 +1342,24 @@ def parse_arguments():
     parser.add_argument('--json', help='write to json file')
     parser.add_argument('--source', default='soundcard', choices=['rtl', 'soundcard', 'file'], help='source program')
     # parser.add_argument('--script', help='script program')
+    parser.add_argument('--demod', default='multimon-ng', choices=['multimon-ng', 'internal'],
+                        help='Demodulate with multimon-ng, or with the built-in demodulator on the audio directly')
+    parser.add_argument('--channels', type=int, default=1,
+                        help='Number of soundcard or audio file channels to decode separately with --demod internal')
+    parser.add_argument('--no-gate', dest='gate', action='store_false',
+                        help='Run the built-in demodulator on all audio instead of only when SAME tones are heard')
     parser.add_argument('--frequency', nargs='*', help='Set the RTL_FM frequency')
     parser.add_argument('--ppm', nargs='*', help='Set the RTL_FM PPM')
     parser.add_argument('--record', nargs='*',
                         help='Record on valid SAME tone. Set recording location. ex. "C:\\Recordings". NOTE: Paths '
                              'can be either absolute or relative. RECORDINGS CURRENTLY DO NOT WORK WITH RTL AND DO NOT '
                              'WORK WITH FILE')
+    parser.add_argument('--no-trim', dest='trim', action='store_false',
+                        help='Keep the whole recording and transcribe all of it, instead of trimming the recording to '
+                             'the alert and the transcription to the voice message')
+    parser.add_argument('--preroll', type=float, default=PREROLL_SECONDS,
+                        help='Seconds of audio from before the header kept at the start of recordings, so they '
+                             'include the SAME bursts (0 disables)')
     parser.add_argument('--transcribe', nargs='*', help='Creates a text file with a transcription of the alert '
                                                         'message. Set transcription location. ex. "C:\\Recordings". '
                                                         'NOTE: Paths can be either absolute or relative. '
@@ -925,20 +1384,39 @@ def parse_arguments():
     parser.add_argument('--monitor', action='store_true', help='Enables monitoring. Choose whether you want the '
                                                                'selected source device output to be played through '
                                                                'the default output device')
+    parser.add_argument('--meter', action='store_true', help='Log the soundcard input level every second')
+    parser.add_argument('--shared_audio', metavar='NAME',
+                        help='Publish the soundcard input in a shared memory block of this name for other processes '
+                             '(see sharedring.py)')
+    parser.add_argument('--daemon', nargs='?', const=client.default_address(),
+                        help='Run as a decode service for client.py, listening on a Unix socket or named pipe. '
+                             'Defaults to ' + client.default_address())
+    parser.add_argument('--cache_size', type=int, default=cache.SIZE,
+                        help='Number of rendered alerts to keep for rebroadcasts and relays (0 disables the render cache)')
+    parser.add_argument('--cache_ttl', type=float, default=cache.TTL,
+                        help='Seconds a rendered alert is kept before it is rendered again')
+    parser.add_argument('--dedup_window', type=float, default=dedup.WINDOW,
+                        help='Seconds a header is remembered so repeats and relays of the same alert are only handled '
+                             'once (0 handles every header)')
+    parser.add_argument('--no-vote', dest='vote', action='store_false',
+                        help='Decode every copy of a header instead of one header voted from its three copies')
     parser.add_argument('--skip_dependency', action='store_true', help='Skips dependency checking (MUST USE IF OFFLINE)'
                         )
+    parser.add_argument('--refresh_dependency', action='store_true',
+                        help='Runs the online dependency check even if the dependency manifest is up to date')
     #    parser.add_argument('--sourceselect', help='Allows you to select microphone input on startup')
     parser.add_argument('--audiofile', help='Set audio file location when using source type "FILE" '
                                             'ex. "C:\\Recordings". NOTE: Paths can be either absolute or '
                                             'relative.')  # FOR DECODING AUDIO FILE
     #    parser.add_argument() FOR ALARM WINDOW OPTIONS
-    parser.set_defaults(text=True)
+    parser.set_defaults(text=True, gate=True, trim=True, vote=True)
     args, unknown = parser.parse_known_args()
     return args
 
 
-def main():
-    args = parse_arguments()
+def main(args=None):
+    if args is None:
+        args = parse_arguments()
     args.lang = args.lang.upper()
     # try:
     #     subprocess.check_output('multimon-ng -a EAS')
@@ -948,9 +1426,27 @@ def main():
     #     os_clear()
     #     os.execv(sys.executable, ['python'] + sys.argv)
     logging.basicConfig(level=args.loglevel, format='%(levelname)s: %(message)s')
-    if args.msg:
-        same_decode(args.msg, args.lang, same_watch=args.same, event_watch=args.event, text=args.text, call=args.call,
-                    command=args.command, jsonfile=args.json)
+    context = DecoderContext.from_args(args)
+    if args.daemon:
+        serve(context, args.daemon)
+    elif args.msg:
+        same_decode(args.msg, context)
+    elif args.source and args.demod == 'internal' and args.source != 'file':
+        try:
+            if args.source == 'rtl':
+                rtl_fm_process = subprocess.Popen(['rtl_fm', '-f', str(args.frequency[0]) + 'M', '-M', 'fm', '-s',
+                                                   str(RTL_SAMPLE_RATE), '-E', 'dc', '-p', str(args.ppm[0]), '-'],
+                                                  stdout=subprocess.PIPE)
+                demodulate(raw_blocks(rtl_fm_process.stdout.read1), context, RTL_SAMPLE_RATE, gate=args.gate)
+            else:
+                import hub
+                capture_hub = start_capture(args, args.channels)
+                ring = capture_hub.ring(args.channels)
+                capture_hub.start()
+                demodulate(hub.blocks(ring), context, SAMPLE_RATE, args.channels, args.gate)
+        except Exception as detail:
+            logging.error(detail)
+            return
     elif args.source:
         if args.source == 'rtl':
             try:
@@ -976,11 +1472,13 @@ def main():
         elif args.source == 'soundcard':
             # sys.stdout.write('Soundcard\n')
             try:
-                multimon_ng_process = subprocess.Popen('multimon-ng -a EAS', stdout=subprocess.PIPE, shell=True)
+                # multimon-ng reads the soundcard through the capture hub, which also feeds the recorder and monitor
+                capture_hub = start_capture(args)
+                multimon_ng_process = subprocess.Popen(['multimon-ng', '-a', 'EAS', '-t', 'raw', '-'],
+                                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                capture_hub.add(multimon_feed(multimon_ng_process.stdin), 1, name='multimon-ng')
+                capture_hub.start()
                 source_process = multimon_ng_process
-                if args.monitor:
-                    sys.stdout.write('MONITORING ENABLED\n')
-                    subprocess.Popen(['python', 'wire.py'])
             except Exception as detail:
                 logging.error(detail)
                 return
@@ -990,24 +1488,28 @@ def main():
                 FILE_NAME_PATH, FILE_NAME = os.path.split(os.path.abspath(args.audiofile))
                 # sys.stdout.write(FILE_NAME_PATH + '\n')
                 # sys.stdout.write(FILE_NAME + '\n')
-                sox_process = subprocess.Popen('"C:\\Program Files (x86)\\sox-14-4-2\\sox.exe" -V1 -t wav "' +
-                                               os.path.abspath(args.audiofile) + '" -e signed-integer -b 16 -c 1 -r '
-                                                                                 '22050 -t raw "process.raw"',
-                                               stdout=subprocess.PIPE, shell=True)
-                sox_process.communicate()
-                multimon_ng_process = subprocess.Popen('multimon-ng -a EAS -t raw "process.raw"', stdout=subprocess.PIPE
-                                                       , shell=True)
-                while multimon_ng_process.poll() is None:
-                    line = multimon_ng_process.stdout.readline()
-                    if line:
-                        line1 = line.decode('ascii')
-                        logging.debug(line1)
-                        same_decode(line1, args.lang, same_watch=args.same, event_watch=args.event, text=args.text,
-                                    call=args.call, command=args.command, jsonfile=args.json)
+                if args.demod == 'internal':
+                    load_audio()
+                    info = sf.info(args.audiofile)
+                    # Stereo files usually carry one program twice, so they are mixed down unless --channels asks
+                    # for each channel on its own
+                    channels = min(args.channels, info.channels)
+                    demodulate(file_blocks(args.audiofile, channels if channels > 1 else None), context,
+                               info.samplerate, channels, args.gate)
+                else:
+                    sox_process = subprocess.Popen('"C:\\Program Files (x86)\\sox-14-4-2\\sox.exe" -V1 -t wav "' +
+                                                   os.path.abspath(args.audiofile) + '" -e signed-integer -b 16 -c 1 '
+                                                                                     '-r 22050 -t raw "process.raw"',
+                                                   stdout=subprocess.PIPE, shell=True)
+                    sox_process.communicate()
+                    multimon_ng_process = subprocess.Popen('multimon-ng -a EAS -t raw "process.raw"',
+                                                           stdout=subprocess.PIPE, shell=True)
+                    decode_stream(multimon_ng_process.stdout.read1, context)
                 # noinspection PyUnboundLocalVariable
                 # same1 = 'TEST'
                 # message1 = 'TEST'
                 global same1, message1
+                import multiprocessing
                 # sys.stdout.write(str(same1) + '\n')
                 # sys.stdout.write(str(message1) + '\n')
                 background_process = multiprocessing.Process(name='background_process',
@@ -1018,12 +1520,13 @@ def main():
                                                                    args.lang,
                                                                    args.transcription_compute,
                                                                    args.transcription_beam_size,
-                                                                   args.transcription_device))
+                                                                   args.transcription_device, args.trim))
                 background_process.daemon = True
                 background_process.start()
                 background_process.join()
                 # REMOVE PROCESS FILE
-                os.remove(os.path.join(os.path.abspath(''), 'process.raw'))
+                if args.demod != 'internal':
+                    os.remove(os.path.join(os.path.abspath(''), 'process.raw'))
                 input("Please press enter to close the program...")
                 exit()
             except Exception as detail:
@@ -1033,40 +1536,30 @@ def main():
             sys.stdout.write('ERROR' + '\n')
             input("Please press enter to close the program...")
             exit()
-        while True:
-            line = source_process.stdout.readline()
-            if line:
-                line1 = line.decode('ascii')
-                logging.debug(line1)
-                same_decode(line1, args.lang, same_watch=args.same, event_watch=args.event, text=args.text,
-                            call=args.call, command=args.command, jsonfile=args.json)
+        decode_stream(source_process.stdout.read1, context)
     else:
-        while True:
-            for line in sys.stdin:
-                logging.debug(line)
-                same_decode(line, args.lang, same_watch=args.same, event_watch=args.event, text=args.text,
-                            call=args.call, command=args.command, jsonfile=args.json)
+        decode_stream(sys.stdin.buffer.read1, context)
 
 
 if __name__ == "__main__":
     # global RESTART_QUEUE
     args = parse_arguments()
     try:
-        if not args.skip_dependency:
-            os.system("title " + "dsame3 Dependency Checker")
+        models = required_models(args)
+        if not args.skip_dependency and (args.refresh_dependency or not manifest_current(models)):
+            if platform.system() == 'Windows':
+                os.system("title " + "dsame3 Dependency Checker")
             # if platform.system() == 'Linux':
             #     os.system('sudo apt install xterm')
             if platform.system() == 'MacOS':
                 os.system('/bin/bash -c "$(curl -fsSL https://raw.githubusercontent.com/Homebrew/install/HEAD/install'
                           '.sh)"')
-            dependency_check_model('small')
-            dependency_check_model('medium')
-            dependency_check_model('large-v2')
-            dependency_check_model('small.en')
-            dependency_check_model('medium.en')
+            dependency_check_models(models)
             dependency_check_multimon()
             dependency_check_ffmpeg()
             dependency_check_rtl()
+            if internet_on() and not RESTART_QUEUE:
+                write_manifest(models)
             #os_clear()
         if RESTART_QUEUE:
             # NEED TO FIX AND MAKE PRETTY
@@ -1074,8 +1567,9 @@ if __name__ == "__main__":
                   "close the program...")
             exit()
         else:
-            os.system("title " + "dsame3")
-            main()
+            if platform.system() == 'Windows':
+                os.system("title " + "dsame3")
+            main(args)
     except KeyboardInterrupt:
         pass
     except Exception as e:
@@ -0,0 +1,38 @@
+"""Merged SAME location code index.
+
+INDEX maps each SSCCC code to a bitmask of the countries whose code tables list it and the name each table gives
+it, so a header needs one dict lookup per location code to pick its country and drop the codes that do not belong.
+"""
+import defs
+
+US, CA, MX = 1, 2, 4
+COUNTRIES = (('US', US), ('CA', CA), ('MX', MX))  # In tie-break order
+TABLES = ((US, defs.US_SAME_CODE), (CA, defs.CA_SAME_CODE), (MX, defs.MX_SAME_CODE))
+NOT_FOUND = (0, (None, None, None))
+
+
+def build_index():
+    """Return {SSCCC: (country mask, (US name, CA name, MX name))} from the defs code tables"""
+    index = {}
+    for position, (bit, table) in enumerate(TABLES):
+        for code, name in table.items():
+            mask, names = index.get(code, NOT_FOUND)
+            names = names[:position] + (name,) + names[position + 1:]
+            index[code] = (mask | bit, names)
+    return index
+
+
+INDEX = build_index()
+
+
+def lookup(ssccc):
+    """Return the country mask and names of a SSCCC code"""
+    return INDEX.get(ssccc, NOT_FOUND)
+
+
+def detect_country(codes):
+    """Return the country whose table knows the most PSSCCC codes (ties go to US, then CA, then MX) and the codes
+    that table does not know"""
+    masks = [INDEX.get(code[1:], NOT_FOUND)[0] for code in codes]
+    country, bit = max(COUNTRIES, key=lambda c: sum(1 for mask in masks if mask & c[1]))
+    return country, [code for code, mask in zip(codes, masks) if not mask & bit]
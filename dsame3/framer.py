@@ -0,0 +1,120 @@
+"""Incremental SAME framing of demodulator output.
+
+SameFramer takes the output of multimon-ng (or any demodulator printing SAME text) in whatever chunks the pipe hands
+over: partial lines, several messages at once, end of message markers in between. It keeps its place between calls
+and returns a list of events:
+
+    (HEADER, 'ZCZC-ORG-EEE-PSSCCC+TTTT-JJJHHMM-LLLLLLLL-')
+    (EOM, 'NNNN')
+
+Each byte is looked at once, so a header is decoded as soon as its last dash arrives, without waiting for the newline,
+and nothing is scanned twice.
+"""
+import string
+
+HEADER = 'header'
+EOM = 'eom'
+
+VALID_CHARS = ''.join([string.ascii_uppercase, string.digits, '+-/*']).encode('ascii')
+CLEAN_TABLE = bytes.maketrans(string.ascii_lowercase.encode('ascii'), string.ascii_uppercase.encode('ascii'))
+CLEAN_DELETE = bytes(c for c in range(256) if c not in VALID_CHARS + string.ascii_lowercase.encode('ascii'))
+
+# ZCZC, ORG, EEE, 31 location codes, TTTT, JJJHHMM, LLLLLLLL and their separators
+MAX_HEADER = 4 + 4 + 4 + 31 * 7 + 5 + 8 + 9
+
+
+class SameFramer:
+    """Resumable SAME framer. Call feed() with each chunk of output and close() when the source ends"""
+
+    def __init__(self):
+        self.header = None  # bytearray while inside a header
+        self.dashes = -1  # dashes seen since the +, -1 before the +
+        self.carry = b''  # end of the last chunk, in case a marker is split across chunks
+
+    def feed(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii', 'ignore')
+        events = []
+        start = 0
+        while start <= len(chunk):
+            newline = chunk.find(b'\n', start)
+            end = len(chunk) if newline == -1 else newline
+            self.scan(chunk[start:end].translate(CLEAN_TABLE, CLEAN_DELETE), events)
+            if newline == -1:
+                break
+            self.end_line(events)
+            start = newline + 1
+        return events
+
+    def close(self):
+        """Return the events for a final line without a newline"""
+        events = []
+        self.end_line(events)
+        return events
+
+    def end_line(self, events):
+        # A header cut short by the end of the line is still passed on, same_decode pads or rejects it
+        if self.header is not None:
+            events.append((HEADER, self.header.decode('ascii')))
+        self.header = None
+        self.carry = b''
+
+    def scan(self, data, events):
+        i = 0
+        while i < len(data):
+            if self.header is None:
+                i = self.search(data, i, events)
+            else:
+                i = self.collect(data, i, events)
+
+    def search(self, data, i, events):
+        """Look for ZCZC or NNNN and return the index to continue from"""
+        carried = len(self.carry)
+        buf = self.carry + data[i:i + 3] if carried else b''
+        zczc, nnnn = buf.find(b'ZCZC'), buf.find(b'NNNN')
+        if zczc == -1 and nnnn == -1:
+            zczc, nnnn = data.find(b'ZCZC', i), data.find(b'NNNN', i)
+            offset = 0
+        else:
+            offset = i - carried  # Index into data of buf[0], may be negative
+        if zczc == -1 and nnnn == -1:
+            self.carry = (self.carry + data[i:])[-3:]
+            return len(data)
+        self.carry = b''
+        if nnnn != -1 and (zczc == -1 or nnnn < zczc):
+            events.append((EOM, 'NNNN'))
+            return offset + nnnn + 4
+        self.header = bytearray(b'ZCZC')
+        self.dashes = -1
+        return offset + zczc + 4
+
+    def collect(self, data, i, events):
+        """Add header bytes up to the dash after the originator code and return the index to continue from"""
+        end = len(data)
+        while i < end:
+            if self.dashes == -1:
+                plus = data.find(b'+', i)
+                if plus == -1:
+                    self.header += data[i:]
+                    i = end
+                    break
+                self.header += data[i:plus + 1]
+                i = plus + 1
+                self.dashes = 0
+            else:
+                dash = data.find(b'-', i)
+                if dash == -1:
+                    self.header += data[i:]
+                    i = end
+                    break
+                self.header += data[i:dash + 1]
+                i = dash + 1
+                self.dashes += 1
+                if self.dashes == 3:
+                    events.append((HEADER, self.header.decode('ascii')))
+                    self.header = None
+                    return i
+        if len(self.header) > MAX_HEADER:
+            # Noise that started with ZCZC, not a header
+            self.header = None
+        return i
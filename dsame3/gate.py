@@ -0,0 +1,86 @@
+"""Activity gate in front of the SAME demodulator.
+
+Around the clock most input is silence or program audio. ActivityGate looks at each block in short slices and
+measures how much of the energy sits at the SAME mark and space tones (two Goertzel bins per slice, one real matrix
+product for the block). Blocks are only passed on to the demodulator while that share is high, with hysteresis so
+the gate stays open across the three header bursts, and the last second or so of audio is held back so the
+preamble that opened the gate is not lost.
+"""
+import collections
+
+import numpy as np
+
+from demod import MARK, SPACE
+
+SLICE = 0.008  # Seconds per energy measurement, about four bits
+OPEN = 0.5  # Share of slice energy at the SAME tones that opens the gate
+CLOSE = 0.2  # Share below which the gate starts to close
+HOLD = 2.0  # Seconds below CLOSE before the gate closes, longer than the gap between bursts
+LOOKBACK = 1.0  # Seconds of audio passed on from before the gate opened
+FLOOR = 1e-8  # Mean square level treated as silence
+
+
+class ActivityGate:
+    """Pass (channels, samples) blocks through while any channel carries SAME-like tones"""
+
+    def __init__(self, sample_rate, lookback=LOOKBACK, hold=HOLD, open_share=OPEN, close_share=CLOSE):
+        self.sample_rate = sample_rate
+        self.slice = max(int(sample_rate * SLICE), 1)
+        self.lookback = int(sample_rate * lookback)
+        self.hold = int(sample_rate * hold)
+        self.open_share = open_share
+        self.close_share = close_share
+        self.bins = {}
+        self.is_open = False
+        self.quiet = 0  # Samples since the share was last above CLOSE
+        self.history = collections.deque()  # Blocks held back while closed
+        self.held = 0
+        self.openings = 0
+
+    def goertzel(self, length):
+        """Return the (length, 4) matrix of cosine and sine terms of the mark and space bins for a slice"""
+        bins = self.bins.get(length)
+        if bins is None:
+            phase = 2 * np.pi * np.outer(np.arange(length) / self.sample_rate, [MARK, SPACE])
+            bins = self.bins[length] = np.concatenate((np.cos(phase), np.sin(phase)), axis=1)
+        return bins
+
+    def share(self, block):
+        """Return the highest share of energy at the SAME tones in any slice of any channel"""
+        channels, length = block.shape
+        size = self.slice if length >= self.slice else length
+        count = length // size
+        slices = block[:, :count * size].reshape(channels * count, size)
+        terms = slices @ self.goertzel(size)
+        tones = np.einsum('ij,ij->i', terms, terms)
+        power = np.einsum('ij,ij->i', slices, slices)
+        # A pure tone puts (size / 2) * its power into its bin
+        shares = tones * 2 / (size * np.maximum(power, FLOOR * size))
+        return float(shares.max())
+
+    def process(self, block):
+        """Return the blocks to demodulate: none while closed, the held back audio and the block when opening"""
+        block = np.asarray(block, dtype=np.float64)
+        if not block.shape[1]:
+            return []
+        share = self.share(block)
+        if share >= self.open_share or (self.is_open and share >= self.close_share):
+            self.quiet = 0
+        else:
+            self.quiet += block.shape[1]
+        if self.is_open:
+            if self.quiet >= self.hold:
+                self.is_open = False
+            return [block]
+        if share >= self.open_share:
+            self.is_open = True
+            self.openings += 1
+            blocks = list(self.history) + [block]
+            self.history.clear()
+            self.held = 0
+            return blocks
+        self.history.append(block)
+        self.held += block.shape[1]
+        while self.history and self.held - self.history[0].shape[1] >= self.lookback:
+            self.held -= self.history.popleft().shape[1]
+        return []
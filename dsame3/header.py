@@ -0,0 +1,73 @@
+"""SAME header parsing.
+
+    ZCZC-ORG-EEE-PSSCCC-PSSCCC+TTTT-JJJHHMM-LLLLLLLL-
+
+parse_header() walks a cleaned header once with str.find, without splitting it into intermediate lists, and returns a
+SameHeader record. A header that cannot be parsed raises HeaderError with the reason.
+"""
+import collections
+
+import sametime
+
+
+class HeaderError(ValueError):
+    """A SAME header that could not be parsed"""
+
+    def __init__(self, reason, position):
+        super().__init__(reason, position)
+        self.reason = reason
+        self.position = position
+
+    def __str__(self):
+        return '%s (at %d)' % (self.reason, self.position)
+
+
+class SameHeader(collections.namedtuple('SameHeader', 'ORG EEE PSSCCC TTTT JJJHHMM LLLLLLLL STATION TYPE')):
+    """A parsed SAME header. PSSCCC is a tuple of location codes, TYPE is None when the station has no /"""
+    __slots__ = ()
+
+    @property
+    def start(self):
+        """Issue time, UTC epoch seconds"""
+        return sametime.start_epoch(self.JJJHHMM)
+
+    @property
+    def end(self):
+        """Purge time, UTC epoch seconds"""
+        return sametime.end_epoch(self.JJJHHMM, self.TTTT)
+
+    @property
+    def remaining(self):
+        """Seconds until the alert expires"""
+        return sametime.remaining(self.JJJHHMM, self.TTTT)
+
+    def __str__(self):
+        return 'ZCZC-%s-%s-%s+%s-%s-%s-' % (self.ORG, self.EEE, '-'.join(self.PSSCCC), self.TTTT, self.JJJHHMM,
+                                            self.LLLLLLLL)
+
+
+def parse_header(same, start=0):
+    """Parse the header beginning at same[start] ('ZCZC') and return (SameHeader, index after the header)"""
+    plus = same.find('+', start)
+    if plus == -1:
+        raise HeaderError('purge time separator (+) not found', start)
+    d1 = same.find('-', start, plus)
+    d2 = same.find('-', d1 + 1, plus) if d1 != -1 else -1
+    d3 = same.find('-', d2 + 1, plus) if d2 != -1 else -1
+    if d3 == -1:
+        raise HeaderError('originator, event or location code missing', start)
+    t1 = same.find('-', plus + 1)
+    t2 = same.find('-', t1 + 1) if t1 != -1 else -1
+    t3 = same.find('-', t2 + 1) if t2 != -1 else -1
+    if t3 == -1:
+        raise HeaderError('purge time, date code or originator code missing', plus)
+    LLLLLLLL = same[t2 + 1:t3]
+    slash = LLLLLLLL.find('/')
+    if slash != -1 and LLLLLLLL.find('/', slash + 1) == -1:
+        STATION, TYPE = LLLLLLLL[:slash], LLLLLLLL[slash + 1:]
+    else:
+        # Station doesn't have to have a /
+        STATION, TYPE = LLLLLLLL, None
+    header = SameHeader(same[d1 + 1:d2], same[d2 + 1:d3], tuple(same[d3 + 1:plus].split('-')), same[plus + 1:t1],
+                        same[t1 + 1:t2], LLLLLLLL, STATION, TYPE)
+    return header, t3 + 1
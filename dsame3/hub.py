@@ -0,0 +1,191 @@
+"""Shared soundcard capture.
+
+CaptureHub opens the input device once. Its callback copies each block into a RingBuffer per consumer: the
+demodulator (multimon-ng fed through a pipe, or the built-in one), the recorder, the monitor and the level meter. All
+consumers see the same samples on the same clock, and the device is no longer opened by several programs at once.
+
+Each ring has one producer (the audio callback) and one consumer. The producer only advances `written` and the
+consumer only advances `consumed`, each after the samples it covers are in place, so neither side takes a lock and a
+slow consumer cannot hold up the callback: when its ring is full, the new frames are dropped for that consumer only
+and counted in `overruns`.
+"""
+import logging
+import math
+import threading
+
+import numpy as np
+
+SECONDS = 5.0  # Audio each ring holds for its consumer
+BLOCKSIZE = 2048  # Frames per callback
+
+
+class RingBuffer:
+    """Single producer, single consumer ring of (frames, channels) audio"""
+
+    def __init__(self, frames, channels, dtype=np.float32):
+        self.size = frames
+        self.channels = channels
+        self.buffer = np.zeros((frames, channels), dtype=dtype)
+        self.written = 0  # Frames written so far, only changed by the producer
+        self.consumed = 0  # Frames read so far, only changed by the consumer
+        self.overruns = 0  # Frames dropped because the ring was full
+        self.ready = threading.Event()
+        self.closed = False
+
+    def write(self, block):
+        """Copy a (frames, channels) block in and return the number of frames that fit"""
+        free = self.size - (self.written - self.consumed)
+        if len(block) > free:
+            self.overruns += len(block) - free
+            block = block[:free]
+        count = len(block)
+        start = self.written % self.size
+        first = min(count, self.size - start)
+        self.buffer[start:start + first] = block[:first]
+        self.buffer[:count - first] = block[first:]
+        self.written += count
+        self.ready.set()
+        return count
+
+    def read(self, timeout=None):
+        """Return a copy of the frames waiting, an empty block if none came within timeout, or None once the ring is
+        closed and empty"""
+        while self.written == self.consumed:
+            if self.closed:
+                return None
+            self.ready.clear()
+            if self.written != self.consumed or self.closed:
+                continue
+            if not self.ready.wait(timeout):
+                return self.buffer[:0].copy()
+        count = self.written - self.consumed
+        start = self.consumed % self.size
+        first = min(count, self.size - start)
+        block = np.concatenate((self.buffer[start:start + first], self.buffer[:count - first]))
+        self.consumed += count
+        return block
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+
+class Consumer:
+    """Call target(block) on its own thread for every block read from a ring"""
+
+    def __init__(self, ring, target, name=None):
+        self.ring = ring
+        self.target = target
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def run(self):
+        while True:
+            block = self.ring.read()
+            if block is None:
+                return
+            try:
+                self.target(block)
+            except Exception as detail:
+                logging.error(' '.join([str(self.thread.name), 'stopped >', str(detail)]))
+                self.ring.close()
+                return
+
+
+class CaptureHub:
+    """Read the input device once and fan its blocks out to consumers"""
+
+    def __init__(self, sample_rate, channels, blocksize=BLOCKSIZE):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.rings = ()  # Replaced, never changed in place, so the callback can walk it without a lock
+        self.stream = None
+
+    def ring(self, channels=None, seconds=SECONDS):
+        """Register a ring receiving the first `channels` input channels and return it"""
+        return self.attach(RingBuffer(int(seconds * self.sample_rate), min(channels or self.channels, self.channels)))
+
+    def attach(self, ring):
+        """Register anything with write(block) and channels (such as sharedring.SharedAudioRing) to be written from
+        the audio callback"""
+        self.rings = self.rings + (ring,)
+        return ring
+
+    def add(self, target, channels=None, seconds=SECONDS, name=None):
+        """Run target(block) on a thread of its own for the (frames, channels) blocks of a new ring"""
+        consumer = Consumer(self.ring(channels, seconds), target, name)
+        consumer.thread.start()
+        return consumer
+
+    def remove(self, ring):
+        self.rings = tuple(other for other in self.rings if other is not ring)
+        ring.close()
+
+    def start(self):
+        import sounddevice
+        self.stream = sounddevice.InputStream(callback=self.callback, channels=self.channels,
+                                              samplerate=self.sample_rate, blocksize=self.blocksize, dtype='float32')
+        self.stream.start()
+        return self
+
+    # noinspection PyUnusedLocal
+    def callback(self, indata, frames, time, status):
+        self.process(indata)
+
+    def process(self, block):
+        for ring in self.rings:
+            ring.write(block[:, :ring.channels])
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        for ring in self.rings:
+            if isinstance(ring, RingBuffer):
+                ring.close()
+
+
+def blocks(ring):
+    """Yield (channels, samples) blocks from a ring, for demod.SameDemodulator.process_channels"""
+    while True:
+        block = ring.read()
+        if block is None:
+            return
+        if len(block):
+            yield block.T
+
+
+class Monitor:
+    """Play the input on the default output device"""
+
+    def __init__(self, sample_rate, channels):
+        import sounddevice
+        self.stream = sounddevice.OutputStream(samplerate=sample_rate, channels=channels, dtype='float32')
+        self.stream.start()
+
+    def play(self, block):
+        self.stream.write(block)
+
+
+def decibels(level):
+    return 20 * math.log10(max(level, 1e-10))
+
+
+class LevelMeter:
+    """Measure the input and call report(peak dBFS, RMS dBFS) every interval seconds"""
+
+    def __init__(self, sample_rate, report, interval=1.0):
+        self.length = int(sample_rate * interval)
+        self.report = report
+        self.frames = 0
+        self.peak = 0.0
+        self.energy = 0.0
+
+    def process(self, block):
+        self.peak = max(self.peak, float(np.abs(block).max()))
+        self.energy += float(np.einsum('ij,ij->', block, block)) / block.shape[1]
+        self.frames += len(block)
+        if self.frames >= self.length:
+            self.report(decibels(self.peak), decibels(math.sqrt(self.energy / self.frames)))
+            self.frames, self.peak, self.energy = 0, 0.0, 0.0
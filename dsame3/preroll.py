@@ -0,0 +1,89 @@
+"""Pre-roll for alert recordings.
+
+A recording can only start once a header has been decoded, by which time the first SAME burst (or more) has gone by.
+PreRollCapture keeps the input open while dsame runs and writes every block into a PreRollBuffer, a ring of the last
+few seconds of audio allocated once at startup. When an alert is recorded, the ring is copied to the recorder and the
+blocks that follow are passed on after it, so the file starts before the header and can be decoded again.
+
+Each frame is stored twice in the ring, one ring length apart, so the last `size` frames are always a single
+contiguous slice of the buffer and handing them over takes one copy.
+"""
+import threading
+
+import numpy as np
+
+
+class PreRollBuffer:
+    """The last `seconds` of (frames, channels) input in a preallocated ring"""
+
+    def __init__(self, seconds, sample_rate, channels, dtype=np.float32):
+        self.size = int(seconds * sample_rate)
+        self.buffer = np.zeros((2 * self.size, channels), dtype=dtype)
+        self.position = 0  # Where the next frame goes, 0 <= position < size
+        self.filled = 0  # Frames held, up to size
+
+    def write(self, block):
+        if not self.size:
+            return
+        block = block[-self.size:]
+        count = len(block)
+        first = min(count, self.size - self.position)
+        for offset in (self.position, self.position + self.size):
+            self.buffer[offset:offset + first] = block[:first]
+        if count > first:
+            self.buffer[:count - first] = block[first:]
+            self.buffer[self.size:self.size + count - first] = block[first:]
+        self.position = (self.position + count) % self.size
+        self.filled = min(self.size, self.filled + count)
+
+    def view(self):
+        """Return the frames held, oldest first, as a view into the ring"""
+        end = self.position + self.size
+        return self.buffer[end - self.filled:end]
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+
+class PreRollCapture:
+    """Keep the input device open, fill the pre-roll and pass the blocks on to the attached recorder"""
+
+    def __init__(self, sample_rate, channels, seconds):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.ring = PreRollBuffer(seconds, sample_rate, channels)
+        self.lock = threading.Lock()
+        self.recorder = None
+        self.stream = None
+
+    def start(self):
+        """Open an input stream of its own, when there is no capture hub to feed process()"""
+        import sounddevice
+        self.stream = sounddevice.InputStream(callback=self.callback, channels=self.channels,
+                                              samplerate=self.sample_rate, dtype='float32')
+        self.stream.start()
+        return self
+
+    # noinspection PyUnusedLocal
+    def callback(self, indata, frames, time, status):
+        self.process(indata)
+
+    def process(self, block):
+        with self.lock:
+            self.ring.write(block)
+            if self.recorder is not None and not self.recorder.put(block.copy()):
+                # Stopped or full
+                self.recorder = None
+
+    def attach(self, recorder):
+        """Feed a recorder (recorder.AlertRecorder), starting with the pre-roll"""
+        with self.lock:
+            recorder.put(self.ring.view().copy())
+            self.recorder = recorder
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
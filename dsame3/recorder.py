@@ -0,0 +1,110 @@
+"""Alert recording straight to disk.
+
+The audio callback only copies each block into a bounded queue. A writer thread takes the blocks off the queue and
+writes them to the WAV file with soundfile, flushing after every block, so memory stays constant however long the
+alert runs and the file on disk is complete up to the last block if the program stops. The decode loop never waits
+for the disk: stop() returns at once and on_done is called from the writer thread once the file is closed.
+
+A recording is capped at max_seconds (the alert's purge time), and at no less than MIN_SECONDS, so an alert whose end
+of message is never heard cannot fill the disk, even with a purge time of 0000.
+"""
+import queue
+import threading
+
+SUBTYPE = 'PCM_24'
+QUEUE_SIZE = 256  # Blocks held between the audio callback and the writer, several seconds of audio
+MIN_SECONDS = 120.0  # Cap for alerts with a shorter purge time, EAS audio messages run two minutes at most
+
+
+class AlertRecorder:
+    """Record (frames, channels) blocks to a sound file on a writer thread"""
+
+    def __init__(self, path, sample_rate, channels, max_seconds=None, subtype=SUBTYPE, on_done=None,
+                 queue_size=QUEUE_SIZE):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.limit = int(max(max_seconds, MIN_SECONDS) * sample_rate) if max_seconds is not None else None
+        self.subtype = subtype
+        self.on_done = on_done
+        self.blocks = queue.Queue(queue_size)
+        self.queued = 0  # Frames queued by put()
+        self.frames = 0  # Frames written
+        self.dropped = 0  # Blocks lost because the writer fell behind
+        self.full = False  # The duration cap was reached
+        self.stopped = False
+        self.error = None
+        self.stream = None
+        self.writer = threading.Thread(target=self.write, name='recorder', daemon=True)
+
+    def start(self, stream=True):
+        """Start the writer and, unless stream is False, a sounddevice input stream feeding it"""
+        self.writer.start()
+        if stream:
+            import sounddevice
+            self.stream = sounddevice.InputStream(callback=self.callback, channels=self.channels,
+                                                  samplerate=self.sample_rate)
+            self.stream.start()
+        return self
+
+    # noinspection PyUnusedLocal
+    def callback(self, indata, frames, time, status):
+        if not self.put(indata.copy()):
+            import sounddevice
+            raise sounddevice.CallbackStop
+
+    def put(self, block):
+        """Queue a block for the writer. Returns False once the recording is full or stopped"""
+        if self.full or self.stopped:
+            return False
+        try:
+            self.blocks.put_nowait(block)
+        except queue.Full:
+            self.dropped += 1
+            return True
+        self.queued += len(block)
+        if self.limit is not None and self.queued >= self.limit:
+            self.full = True
+        return True
+
+    def write(self):
+        import soundfile
+        try:
+            with soundfile.SoundFile(self.path, 'w', self.sample_rate, self.channels, self.subtype) as out:
+                while self.limit is None or self.frames < self.limit:
+                    block = self.blocks.get()
+                    if block is None:
+                        break
+                    if self.limit is not None:
+                        block = block[:self.limit - self.frames]
+                    out.write(block)
+                    out.flush()
+                    self.frames += len(block)
+        except Exception as e:
+            self.error = e
+        self.stopped = True
+        if self.on_done:
+            self.on_done(self)
+
+    def stop(self):
+        """Stop the input stream and let the writer finish the file in the background"""
+        self.stopped = True
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+        while self.writer.is_alive():
+            try:
+                self.blocks.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return self
+
+    def join(self, timeout=None):
+        """Wait for the writer to close the file"""
+        self.writer.join(timeout)
+        return not self.writer.is_alive()
+
+    @property
+    def seconds(self):
+        return self.frames / self.sample_rate
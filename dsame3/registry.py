@@ -0,0 +1,90 @@
+"""Alerts in effect.
+
+AlertRegistry keeps the alerts that have not reached their purge time, indexed by county (SSCCC), with a min-heap
+of purge times. Expired alerts are popped off the heap, in order, whenever the registry is used, and passed to the
+on_expire callback. Loops that wait for input use next_expiry() to wake up and call expire() on time while no alert
+comes in.
+"""
+import collections
+import heapq
+import itertools
+import time
+
+import dedup
+
+ActiveAlert = collections.namedtuple('ActiveAlert', 'key header start end')
+
+
+class AlertRegistry:
+    """Active alerts by (ORG, EEE, sorted PSSCCC, JJJHHMM, TTTT) and by county"""
+
+    def __init__(self, on_expire=None, clock=time.time):
+        self.on_expire = on_expire
+        self.clock = clock
+        self.alerts = {}
+        self.areas = collections.defaultdict(set)  # SSCCC -> alert keys; SS000 for a whole state, 00000 for all
+        self.heap = []  # (end, count, key)
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.alerts)
+
+    def add(self, header, now=None):
+        """Register an alert and return its ActiveAlert, or None if it has already expired"""
+        if now is None:
+            now = self.clock()
+        self.expire(now)
+        key = dedup.alert_key(header)
+        alert = self.alerts.get(key)
+        if alert is not None:
+            return alert
+        end = header.end
+        if end <= now:
+            return None
+        alert = self.alerts[key] = ActiveAlert(key, header, header.start, end)
+        for code in header.PSSCCC:
+            self.areas[code[1:]].add(key)
+        heapq.heappush(self.heap, (end, next(self.counter), key))
+        return alert
+
+    def remove(self, key):
+        alert = self.alerts.pop(key, None)
+        if alert is not None:
+            for code in alert.header.PSSCCC:
+                keys = self.areas.get(code[1:])
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.areas[code[1:]]
+        return alert
+
+    def expire(self, now=None):
+        """Remove the alerts past their purge time and return them, earliest first"""
+        if now is None:
+            now = self.clock()
+        expired = []
+        while self.heap and self.heap[0][0] <= now:
+            end, count, key = heapq.heappop(self.heap)
+            alert = self.remove(key)
+            if alert is not None:
+                expired.append(alert)
+                if self.on_expire:
+                    self.on_expire(alert)
+        return expired
+
+    def next_expiry(self):
+        """Return the epoch seconds of the next purge time, or None when nothing is active"""
+        return self.heap[0][0] if self.heap else None
+
+    def active(self, fips=None, now=None):
+        """Return the alerts in effect, soonest to expire first. fips (SSCCC or PSSCCC) limits them to one county,
+        including alerts for its whole state or the whole country"""
+        self.expire(now)
+        if fips is None:
+            keys = self.alerts.keys()
+        else:
+            fips = fips[-5:]
+            keys = set()
+            for area in (fips, fips[:2] + '000', '00000'):
+                keys |= self.areas.get(area, set())
+        return sorted((self.alerts[key] for key in keys), key=lambda alert: alert.end)
@@ -0,0 +1,74 @@
+"""SAME date and purge time arithmetic.
+
+A header gives the issue time as JJJHHMM (UTC day of year, hour and minute, no year) and the purge time as TTTT
+(hours and minutes). These are turned into UTC epoch seconds with integer arithmetic. The year is the one that puts
+the issue time nearest to now, so an alert sent on day 365 and heard just after midnight on January 1 belongs to
+the year before. The start of the current year is cached until the year changes.
+"""
+import calendar
+import time
+
+DAY = 86400
+HALF_YEAR = 183 * DAY
+
+YEAR_STARTS = {}
+YEAR = (None, 0, 0)  # (current UTC year, epoch of its January 1, epoch of the next January 1)
+
+
+def year_start(year):
+    """Return the epoch seconds of January 1 00:00 UTC"""
+    start = YEAR_STARTS.get(year)
+    if start is None:
+        start = YEAR_STARTS[year] = calendar.timegm((year, 1, 1, 0, 0, 0))
+    return start
+
+
+def current_year(now):
+    global YEAR
+    if not YEAR[1] <= now < YEAR[2]:
+        year = time.gmtime(now).tm_year
+        YEAR = (year, year_start(year), year_start(year + 1))
+    return YEAR
+
+
+def date_offset(JJJHHMM):
+    """Return the seconds from January 1 00:00 UTC to a JJJHHMM date code"""
+    if len(JJJHHMM) != 7 or not JJJHHMM.isdigit():
+        raise ValueError('invalid date code: ' + JJJHHMM)
+    day, hour, minute = int(JJJHHMM[:3]), int(JJJHHMM[3:5]), int(JJJHHMM[5:])
+    if not 1 <= day <= 366 or hour > 23 or minute > 59:
+        raise ValueError('invalid date code: ' + JJJHHMM)
+    return (day - 1) * DAY + hour * 3600 + minute * 60
+
+
+def purge_seconds(TTTT):
+    """Return the purge time TTTT (HHMM) in seconds"""
+    return int(TTTT[:2]) * 3600 + int(TTTT[2:]) * 60
+
+
+def start_epoch(JJJHHMM, now=None):
+    """Return the UTC epoch seconds of a JJJHHMM date code, in the year nearest to now"""
+    if now is None:
+        now = time.time()
+    year, start, end = current_year(now)
+    offset = date_offset(JJJHHMM)
+    epoch = start + offset
+    if epoch - now > HALF_YEAR:
+        # Sent late last year
+        epoch = year_start(year - 1) + offset
+    elif now - epoch > HALF_YEAR:
+        # Sent early next year, heard by a slow clock
+        epoch = end + offset
+    return epoch
+
+
+def end_epoch(JJJHHMM, TTTT, now=None):
+    """Return the UTC epoch seconds when the alert expires"""
+    return start_epoch(JJJHHMM, now) + purge_seconds(TTTT)
+
+
+def remaining(JJJHHMM, TTTT, now=None):
+    """Return the seconds until the alert expires, 0 once it has"""
+    if now is None:
+        now = time.time()
+    return max(0, end_epoch(JJJHHMM, TTTT, now) - now)
@@ -0,0 +1,148 @@
+"""Live audio in shared memory for other processes.
+
+SharedAudioRing is a ring of float32 (frames, channels) audio in a multiprocessing.shared_memory block, written by the
+capture hub straight from the audio callback. Any number of processes can attach a SharedAudioReader by name and
+read the live input with no pipes, pickling or temporary files, and no extra capture.
+
+The block starts with a small header of int64 fields:
+
+    MAGIC, VERSION, written (frames written so far), sample rate, channels, capacity (frames), writing
+
+followed by the ring. Before it copies a block in, the writer sets `writing` to where the block ends, and once the
+block is in place it advances `written` to the same frame. A reader never sees frames that are not there yet, and
+after copying frames out it checks `writing` to find which of them an unfinished write may have overwritten. A reader
+that falls more than a ring behind skips ahead to the oldest frames still held and counts what it missed in
+`overruns`, and frames overwritten while they were being copied out are dropped the same way.
+"""
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = 0x53414d45  # 'SAME'
+VERSION = 2
+HEADER = 8  # int64 fields reserved for the header
+WRITTEN, SAMPLE_RATE, CHANNELS, CAPACITY, WRITING = 2, 3, 4, 5, 6
+SECONDS = 30.0  # Audio held for readers
+POLL = 0.01  # Seconds between checks while a reader waits for audio
+
+CREATED = set()  # Blocks created by this process, still tracked for removal
+
+
+def attach(name):
+    """Attach to an existing block without letting this process's resource tracker remove it at exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python before 3.13 always tracks the block, so stop tracking it by hand
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        if shm.name not in CREATED:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedAudioRing:
+    """Writer side. Create it in the capturing process, register it with CaptureHub.attach and close() it at exit"""
+
+    def __init__(self, name, sample_rate, channels, seconds=SECONDS):
+        self.channels = channels
+        self.capacity = int(seconds * sample_rate)
+        size = HEADER * 8 + self.capacity * channels * 4
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        CREATED.add(self.shm.name)
+        self.header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((self.capacity, channels), dtype=np.float32, buffer=self.shm.buf, offset=HEADER * 8)
+        self.header[:] = 0
+        self.header[1] = VERSION
+        self.header[SAMPLE_RATE], self.header[CHANNELS], self.header[CAPACITY] = sample_rate, channels, self.capacity
+        self.header[0] = MAGIC  # Last, so readers only attach to a complete header
+        self.written = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def write(self, block):
+        """Copy a (frames, channels) block in and return its length. A block longer than the ring counts in full,
+        only its last capacity frames are kept"""
+        total = len(block)
+        block = block[-self.capacity:]
+        count = len(block)
+        self.header[WRITING] = self.written + total
+        start = (self.written + total - count) % self.capacity
+        first = min(count, self.capacity - start)
+        self.data[start:start + first] = block[:first]
+        self.data[:count - first] = block[first:]
+        self.written += total
+        self.header[WRITTEN] = self.written
+        return total
+
+    def close(self):
+        """Release and remove the block"""
+        self.header = self.data = None
+        self.shm.close()
+        self.shm.unlink()
+        CREATED.discard(self.shm.name)
+
+
+class SharedAudioReader:
+    """Reader side, in any process: read the audio written after it attached, or the latest frames held"""
+
+    def __init__(self, name):
+        self.shm = attach(name)
+        self.header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        if self.header[0] != MAGIC or self.header[1] != VERSION:
+            self.shm.close()
+            raise ValueError('not a shared audio ring: ' + name)
+        self.sample_rate = int(self.header[SAMPLE_RATE])
+        self.channels = int(self.header[CHANNELS])
+        self.capacity = int(self.header[CAPACITY])
+        self.data = np.ndarray((self.capacity, self.channels), dtype=np.float32, buffer=self.shm.buf,
+                               offset=HEADER * 8)
+        self.position = int(self.header[WRITTEN])  # Next frame to read
+        self.overruns = 0
+
+    def copy(self, start, end):
+        """Copy frames [start, end) out of the ring and return (first frame still valid, frames)"""
+        first = start % self.capacity
+        count = end - start
+        head = min(count, self.capacity - first)
+        frames = np.concatenate((self.data[first:first + head], self.data[:count - head]))
+        # The writer may have lapped the oldest frames while they were copied, or be part way through doing so
+        valid = min(end, max(start, int(self.header[WRITING]) - self.capacity))
+        return valid, frames[valid - start:]
+
+    def read(self, timeout=None, max_frames=None):
+        """Return the frames written since the last read, waiting up to timeout seconds (forever if None) for some.
+        Returns an empty block on timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        written = int(self.header[WRITTEN])
+        while written == self.position:
+            if deadline is not None and time.monotonic() >= deadline:
+                return self.data[:0].copy()
+            time.sleep(POLL)
+            written = int(self.header[WRITTEN])
+        start = max(self.position, written - self.capacity)
+        self.overruns += start - self.position
+        if max_frames is not None:
+            written = min(written, start + max_frames)
+        valid, frames = self.copy(start, written)
+        self.overruns += valid - start
+        self.position = written
+        return frames
+
+    def latest(self, frames):
+        """Return up to the last `frames` frames held, without moving the read position"""
+        written = int(self.header[WRITTEN])
+        start = max(0, written - min(frames, self.capacity))
+        return self.copy(start, written)[1]
+
+    def blocks(self):
+        """Yield the audio as it arrives"""
+        while True:
+            yield self.read()
+
+    def close(self):
+        self.header = self.data = None
+        self.shm.close()
@@ -0,0 +1,151 @@
+"""Attention signal detection.
+
+An alert is sent as three SAME header bursts, an attention signal, the voice message and three end of message
+bursts. The attention signal is the EAS two-tone (853 Hz and 960 Hz together) or the NOAA Weather Radio 1050 Hz
+tone. AttentionToneDetector measures five Goertzel bins (the three attention tones and the two SAME tones) over
+50 ms slices of each block with one matrix product, and reports each signal with its start and end time.
+message_span() uses what it found to place the voice message in a recording, alert_span() the whole alert.
+"""
+import collections
+
+import numpy as np
+
+from demod import MARK, SPACE
+
+TWO_TONE = 'two-tone'
+NWR_TONE = '1050 Hz'
+SAME_BURST = 'SAME'
+FREQUENCIES = [853.0, 960.0, 1050.0, MARK, SPACE]
+
+SLICE = 0.05  # Seconds per measurement
+SHARE = 0.6  # Share of the slice energy an attention tone needs
+BURST_SHARE = 0.35  # Share a SAME burst needs, its energy is spread by the bit changes
+FLOOR = 1e-8  # Mean square level treated as silence
+MIN_LENGTH = {TWO_TONE: 1.0, NWR_TONE: 1.0, SAME_BURST: 0.2}  # Seconds
+GAP = 0.2  # Seconds of dropout bridged within one signal
+MARGIN = 0.5  # Seconds kept around the alert by alert_span()
+BURST_GAP = 2.0  # Seconds between the bursts of one group (header or end of message)
+
+Tone = collections.namedtuple('Tone', 'kind start end')  # start and end in seconds from the start of the audio
+
+
+class AttentionToneDetector:
+    """Find attention signals and SAME bursts in a stream of blocks"""
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.slice = max(int(sample_rate * SLICE), 1)
+        phase = 2 * np.pi * np.outer(np.arange(self.slice) / sample_rate, FREQUENCIES)
+        self.bins = np.concatenate((np.cos(phase), np.sin(phase)), axis=1)
+        self.carry = np.zeros(0)
+        self.position = 0  # Slices measured so far
+        self.kind = None  # Signal being heard
+        self.start = self.last = 0  # First and last slice of it
+
+    def classify(self, slices):
+        """Return the signal heard in each row of slices, None for anything else"""
+        terms = slices @ self.bins
+        count = len(FREQUENCIES)
+        tones = terms[:, :count] ** 2 + terms[:, count:] ** 2
+        power = np.einsum('ij,ij->i', slices, slices)
+        shares = tones * 2 / (self.slice * np.maximum(power, FLOOR * self.slice))[:, None]
+        two_tone = (shares[:, 0] + shares[:, 1] >= SHARE) & (np.minimum(shares[:, 0], shares[:, 1]) >= SHARE / 4)
+        nwr = shares[:, 2] >= SHARE
+        same = shares[:, 3] + shares[:, 4] >= BURST_SHARE
+        kinds = np.full(len(slices), None, dtype=object)
+        kinds[same] = SAME_BURST
+        kinds[nwr] = NWR_TONE
+        kinds[two_tone] = TWO_TONE
+        return kinds
+
+    def process(self, block):
+        """Measure a block of samples ((samples,) or sounddevice (samples, channels)) and return the signals that
+        ended in it"""
+        block = np.asarray(block, dtype=np.float64)
+        if block.ndim > 1:
+            block = block.mean(axis=1)
+        block = np.concatenate((self.carry, block))
+        count = len(block) // self.slice
+        self.carry = block[count * self.slice:]
+        found = []
+        for kind in self.classify(block[:count * self.slice].reshape(count, self.slice)):
+            if kind is not None and kind == self.kind:
+                self.last = self.position
+            elif kind is not None:
+                found += self.end_signal()
+                self.kind, self.start, self.last = kind, self.position, self.position
+            elif self.kind is not None and self.position - self.last > GAP / SLICE:
+                found += self.end_signal()
+            self.position += 1
+        return found
+
+    def end_signal(self):
+        kind, self.kind = self.kind, None
+        if kind is None:
+            return []
+        start, end = self.start * SLICE, (self.last + 1) * SLICE
+        return [Tone(kind, start, end)] if end - start >= MIN_LENGTH[kind] else []
+
+    def flush(self):
+        """Return the signal still being heard at the end of the audio"""
+        return self.end_signal()
+
+
+def find_tones(samples, sample_rate):
+    """Return the attention signals and SAME bursts in a recording, in order"""
+    detector = AttentionToneDetector(sample_rate)
+    return detector.process(samples) + detector.flush()
+
+
+def message_span(found, length, sample_rate):
+    """Return the (start, end) sample indices of the voice message in a recording of length samples, given the
+    signals found in it: after the attention signal (or the header bursts when there is none) and before the end of
+    message bursts"""
+    start, end = 0, length
+    attention = [tone for tone in found if tone.kind != SAME_BURST]
+    if attention:
+        start = int(attention[-1].end * sample_rate)
+    else:
+        # No attention signal, skip the header bursts at the start
+        for tone in found:
+            if tone.start * sample_rate <= start + 2 * sample_rate:
+                start = int(tone.end * sample_rate)
+    later = [tone for tone in found if tone.kind == SAME_BURST and tone.start * sample_rate > start]
+    if later:
+        end = int(later[0].start * sample_rate)
+    return start, max(start, end)
+
+
+def burst_groups(found):
+    """Return the SAME bursts found, in groups of bursts heard close together"""
+    groups = []
+    for tone in found:
+        if tone.kind != SAME_BURST:
+            continue
+        if groups and tone.start - groups[-1][-1].end <= BURST_GAP:
+            groups[-1].append(tone)
+        else:
+            groups.append([tone])
+    return groups
+
+
+def alert_span(found, length, sample_rate):
+    """Return the (start, end) sample indices of the alert in a recording: from the header bursts to the end of the
+    last end of message burst, the end staying put when no end of message was found. Returns None unless header
+    bursts come before the attention signal, or before the voice and a later group of bursts, as in a recording
+    started after the header had gone by"""
+    groups = burst_groups(found)
+    attention = [tone for tone in found if tone.kind != SAME_BURST]
+    if not groups:
+        return None
+    header = groups[0]
+    if attention:
+        if header[-1].end > attention[0].start:
+            return None
+    elif len(groups) < 2:
+        # A lone group could be the header or the end of message
+        return None
+    start, end = max(0, int((header[0].start - MARGIN) * sample_rate)), length
+    if len(groups) > 1:
+        end = min(length, int((groups[-1][-1].end + MARGIN) * sample_rate))
+    return start, end
@@ -0,0 +1,200 @@
+"""Majority voting across the three copies of a SAME header.
+
+Every header is sent three times about a second apart. On a noisy channel each copy can carry different bit errors,
+and a corrupted location code is otherwise passed on as a code of its own. HeaderVoter sits between the framer and
+same_decode: it groups the copies of one header (heard within a burst and a gap of each other, and within a few
+edits of each other), rebuilds the header character by character by majority and passes one header on, with the
+number of copies heard and the share of them that agreed on each field:
+
+    voter = HeaderVoter()
+    for kind, text, confidence in voter.feed(framer.feed(chunk)):
+        same_decode(text, context, confidence=confidence)
+
+Two identical copies are a majority, so a clean header is passed on as soon as the second copy arrives and the third
+is absorbed. Otherwise the header is voted on when the third copy arrives, when a different header or an end of
+message comes in, or when poll() finds that no more copies are due.
+"""
+import collections
+import time
+
+from framer import EOM, HEADER
+from header import HeaderError, parse_header
+
+COPIES = 3
+BYTE_TIME = 8 / 520.83  # Seconds to send one character
+GAP = 1.0  # Seconds of silence between the copies
+SLACK = 2.0  # Seconds allowed for demodulator and pipe delays
+DIFFERENCE = 0.2  # Share of characters that may differ between copies of one header
+SLIP = 3  # Characters a copy may gain or lose and still be compared
+MIN_LENGTH = len('ZCZC-ORG-EEE-PSSCCC')  # Shortest copy that can be matched to others
+
+Group = collections.namedtuple('Group', 'copies first')
+
+
+def edit_distance(a, b, limit):
+    """Return the Levenshtein distance between a and b, or limit + 1 once it is known to be larger"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) == len(b):
+        # Bit errors change characters, they do not move them
+        distance = sum(1 for x, y in zip(a, b) if x != y)
+        if distance <= limit:
+            return distance
+    band = min(limit, SLIP + abs(len(a) - len(b)))
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        low, high = max(1, i - band), min(len(b), i + band)
+        current = [limit + 1] * (len(b) + 1)
+        if low == 1:
+            current[0] = i
+        for j in range(low, high + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+        if min(current[low - 1:high + 1]) > limit:
+            return limit + 1
+        previous = current
+    return min(previous[len(b)], limit + 1)
+
+
+def same_header(a, b):
+    """Return True if two copies are close enough to be the same header. A copy cut short is compared with the
+    start of the other"""
+    length = min(len(a), len(b))
+    if length < MIN_LENGTH:
+        return False
+    limit = int(length * DIFFERENCE)
+    return edit_distance(a[:length], b[:length], limit) <= limit
+
+
+def majority(copies):
+    """Return the header rebuilt from its copies and the share of copies agreeing on each character"""
+    lengths = collections.Counter(len(copy) for copy in copies).most_common()
+    length = lengths[0][0] if lengths[0][1] > 1 else max(len(copy) for copy in copies)
+    chars, agreement = [], []
+    for i in range(length):
+        # Earlier copies win ties
+        votes = collections.Counter(copy[i] for copy in copies if i < len(copy))
+        char, count = votes.most_common(1)[0]
+        chars.append(char)
+        agreement.append(count / len(copies))
+    return ''.join(chars), agreement
+
+
+def field_confidence(text, agreement):
+    """Return the lowest agreement within each field of a header, location codes by code"""
+    plus = text.find('+')
+    if plus == -1:
+        return {}
+    confidence = {'PSSCCC': {}}
+    names = ['ZCZC', 'ORG', 'EEE']
+    start = 0
+    for index, field in enumerate(text[:plus].split('-')):
+        end = start + len(field)
+        score = min(agreement[start:end], default=0.0)
+        if index >= len(names):
+            confidence['PSSCCC'][field] = min(score, confidence['PSSCCC'].get(field, 1.0))
+        elif index:
+            confidence[names[index]] = score
+        start = end + 1
+    for name, field in zip(['TTTT', 'JJJHHMM', 'LLLLLLLL'], text[plus + 1:].split('-')):
+        end = start + len(field)
+        confidence[name] = min(agreement[start:end], default=0.0)
+        start = end + 1
+    return confidence
+
+
+def vote(copies):
+    """Return (header, confidence) for the copies of one header. If the voted header cannot be parsed, the first
+    copy that can is used instead"""
+    text, agreement = majority(copies)
+    try:
+        parse_header(text)
+    except HeaderError:
+        for copy in copies:
+            try:
+                parse_header(copy)
+            except HeaderError:
+                continue
+            text, agreement = copy, [1 / len(copies)] * len(copy)
+            break
+    confidence = field_confidence(text, agreement)
+    confidence['copies'] = len(copies)
+    return text, confidence
+
+
+class HeaderVoter:
+    """Turn framer events into (kind, text, confidence) events with one header per group of copies. confidence is
+    None for end of message events and when copies is 1, which passes every header on as it is"""
+
+    def __init__(self, copies=COPIES, clock=time.monotonic):
+        self.copies = copies
+        self.clock = clock
+        self.group = None
+        self.passed = False  # The group's header has been passed on, later copies are absorbed
+        self.last = 0.0  # When the last copy of the group arrived
+        self.voted = 0
+        self.absorbed = 0
+
+    def deadline(self):
+        last = self.group.copies[-1]
+        return self.last + len(last) * BYTE_TIME + GAP + SLACK
+
+    def timeout(self, now=None):
+        """Return the seconds until poll() has work to do, None while no header is waiting"""
+        if self.group is None:
+            return None
+        if now is None:
+            now = self.clock()
+        return max(0.0, self.deadline() - now)
+
+    def feed(self, events, now=None):
+        if self.copies == 1:
+            return [(kind, text, None) for kind, text in events]
+        if now is None:
+            now = self.clock()
+        out = self.poll(now)
+        for kind, text in events:
+            if kind == EOM:
+                out += self.flush()
+                out.append((kind, text, None))
+            elif kind == HEADER:
+                out += self.add(text, now)
+        return out
+
+    def add(self, text, now):
+        if self.group is not None and not same_header(self.group.first, text):
+            out = self.flush()
+        else:
+            out = []
+        if self.group is None:
+            self.group, self.passed = Group([text], text), False
+        else:
+            self.group.copies.append(text)
+            if self.passed:
+                self.absorbed += 1
+        self.last = now
+        copies = self.group.copies
+        if not self.passed and (len(copies) >= self.copies or copies.count(text) * 2 > self.copies):
+            out += self.pass_on()
+        if len(copies) >= self.copies:
+            self.group = None
+        return out
+
+    def pass_on(self):
+        self.passed = True
+        self.voted += 1
+        text, confidence = vote(self.group.copies)
+        return [(HEADER, text, confidence)]
+
+    def poll(self, now=None):
+        """Pass on the header whose copies are no longer due"""
+        if self.group is None:
+            return []
+        if now is None:
+            now = self.clock()
+        return self.flush() if now >= self.deadline() else []
+
+    def flush(self):
+        """Pass on the header being voted on, at an end of message or the end of the source"""
+        out = [] if self.group is None or self.passed else self.pass_on()
+        self.group = None
+        return out
@@ -0,0 +1,62 @@
+"""Location and event watch filter.
+
+The --same and --event lists are compiled once into a WatchFilter. A SAME location code is PSSCCC: P is the part of
+the county (0 for the whole county), SS the state and CCC the county (000 for the whole state). A watched code
+matches a header code when the areas overlap, so watching 029095 catches alerts for any part of county 29095 and
+for all of state 29, and watching 129095 catches alerts for that part, the whole county and the whole state.
+000000 (the whole country) matches every watch.
+"""
+import collections
+
+
+class WatchFilter:
+    """Compiled --same and --event lists. match() returns the watched codes an alert covers"""
+
+    def __init__(self, same=None, events=None):
+        codes = [code.strip() for code in same or ()]
+        for code in codes:
+            if len(code) != 6 or not code.isdigit():
+                raise ValueError('invalid SAME code to watch: ' + code)
+        self.codes = frozenset(codes)
+        self.events = frozenset(event.strip().upper() for event in events or ())
+        self.exact = frozenset(code for code in codes if code[0] != '0' and code[3:] != '000')
+        self.counties = frozenset(code[1:] for code in codes if code[0] == '0' and code[3:] != '000')
+        # Per state index: the whole-state watches, and every watch in the state for alerts covering all of it
+        states, by_state, by_county = (collections.defaultdict(set) for _ in range(3))
+        for code in codes:
+            if code[3:] == '000':
+                states[code[1:3]].add(code)
+            by_state[code[1:3]].add(code)
+            by_county[code[1:]].add(code)
+        self.states = {state: frozenset(watched) for state, watched in states.items()}
+        self.by_state = {state: frozenset(watched) for state, watched in by_state.items()}
+        self.by_county = {county: frozenset(watched) for county, watched in by_county.items()}
+
+    def __bool__(self):
+        return bool(self.codes or self.events)
+
+    def match(self, PSSCCC_list, EEE):
+        """Return the sorted watched codes covered by the alert, empty if it is not watched.
+
+        Without a location watch every code in the alert is returned.
+        """
+        if self.events and EEE not in self.events:
+            return ()
+        if not self.codes:
+            return tuple(PSSCCC_list)
+        matched = set()
+        for code in PSSCCC_list:
+            state = code[1:3]
+            if state == '00':
+                return tuple(sorted(self.codes))
+            if state in self.states:
+                matched |= self.states[state]
+            if code[3:] == '000':
+                matched |= self.by_state.get(state, frozenset())
+            elif code[0] == '0':
+                matched |= self.by_county.get(code[1:], frozenset())
+            elif code in self.exact:
+                matched.add(code)
+            elif code[1:] in self.counties:
+                matched.add('0' + code[1:])
+        return tuple(sorted(matched))
@@ -3,14 +3,15 @@
 
 https://github.com/PortAudio/portaudio/blob/master/test/patest_wire.c
 
+With --shared NAME, play the input dsame publishes with --shared_audio NAME instead of opening the input device.
 """
 import argparse
 
-import pyaudio
-
 import sounddevice as sd
 import numpy  # Make sure NumPy is loaded before it is used in the callback
 
+import sharedring
+
 assert numpy  # avoid "imported but unused" message (W0611)
 
 
@@ -47,6 +48,7 @@ parser.add_argument('--dtype', help='audio data type')
 parser.add_argument('--samplerate', type=float, help='sampling rate')
 parser.add_argument('--blocksize', type=int, help='block size')
 parser.add_argument('--latency', type=float, help='latency in seconds')
+parser.add_argument('--shared', help='name of the shared audio block published by dsame --shared_audio')
 args = parser.parse_args(remaining)
 
 
@@ -63,11 +65,31 @@ def callback(indata, outdata, frames, time, status):
 CHUNK = 16000
 RATE = 44100
 
-p = pyaudio.PyAudio()
 
-player = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, output=True, frames_per_buffer=CHUNK)
-stream = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True, frames_per_buffer=CHUNK)
-while True:
-    player.write(bytes(numpy.frombuffer(stream.read(CHUNK), dtype=numpy.int16)))
-    # data = stream.read(CHUNK)  #read audio stream
-    # stream.write(data, CHUNK)  #play back audio stream
+def play_shared(name):
+    """Play the input dsame publishes in a shared audio block"""
+    reader = sharedring.SharedAudioReader(name)
+    with sd.OutputStream(samplerate=reader.sample_rate, channels=reader.channels, dtype='float32',
+                         device=args.output_device, latency=args.latency) as player:
+        for block in reader.blocks():
+            player.write(block)
+
+
+def wire_input():
+    """Pass the input device to the output with PyAudio, only needed without --shared"""
+    import pyaudio
+
+    p = pyaudio.PyAudio()
+
+    player = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, output=True, frames_per_buffer=CHUNK)
+    stream = p.open(format=pyaudio.paInt16, channels=1, rate=RATE, input=True, frames_per_buffer=CHUNK)
+    while True:
+        player.write(bytes(numpy.frombuffer(stream.read(CHUNK), dtype=numpy.int16)))
+        # data = stream.read(CHUNK)  #read audio stream
+        # stream.write(data, CHUNK)  #play back audio stream
+
+
+if args.shared:
+    play_shared(args.shared)
+else:
+    wire_input()
@@ -1,4 +1,7 @@
 @ECHO OFF
 
 REM Change your audio device here if you need to to whatever capture card you're using. As well, make sure to double check the sample rate passed to SAMEDec if you do.
+REM Start the dsame decode service once so each alert does not have to start its own Python interpreter.
+start "dsame3" /min python %~dp0dsame3\dsame.py --skip_dependency --daemon
+
 ffmpeg -f dshow -i audio="Game Capture HD60 S Audio" -f wav pipe:1 | samedec -r 48000 -- %~dp0\record_and_send.bat
\ No newline at end of file
@@ -12,7 +12,8 @@ REM Save SAME header to a temporary file.
 echo %SAMEDEC_MSG%: > alert_temp.txt
 
 REM https://stackoverflow.com/a/6362922
-FOR /F "tokens=* USEBACKQ" %%F IN (`python dsame3/dsame.py --msg '%SAMEDEC_MSG%'`) DO (
+REM client.py hands the header to the dsame decode service started by main.bat (and decodes it directly if the service is not running).
+FOR /F "tokens=* USEBACKQ" %%F IN (`python dsame3/client.py '%SAMEDEC_MSG%'`) DO (
 SET var=%%F
 )
 
@@ -1 +1,4 @@
+REM Start the dsame decode service once so each alert does not have to start its own Python interpreter.
+start "dsame3" /min python %~dp0dsame3\dsame.py --skip_dependency --daemon
+
 ffmpeg -i "dsame3\sample alert\WXR-RWT.ogg" -f wav pipe:1 | samedec -r 44100 -- %~dp0\record_and_send.bat
\ No newline at end of file